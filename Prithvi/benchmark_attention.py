@@ -0,0 +1,126 @@
+import argparse
+import sys
+import time
+
+import torch
+
+from geospatial_fm import TemporalViTEncoder
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the timm and fused attention paths of TemporalViTEncoder"
+    )
+    parser.add_argument("-img_size", help="input height and width", type=int, default=224)
+    parser.add_argument(
+        "-num_frames", help="list of number of frames to benchmark", default="[1,3,6]"
+    )
+    parser.add_argument("-batch_size", help="number of images per forward", type=int, default=1)
+    parser.add_argument("-repeats", help="timed forwards per setting", type=int, default=5)
+    parser.add_argument("-device", help="device to run on", default="cpu")
+    parser.add_argument(
+        "-tolerance", help="maximum absolute difference allowed", type=float, default=1e-4
+    )
+
+    return parser.parse_args()
+
+
+def build_encoders(num_frames, img_size, device):
+    """
+    Build a reference and a fused encoder sharing the same weights.
+    ----------
+    num_frames : int
+        Number of frames of the input.
+    img_size : int
+        Height and width of the input.
+    device : str
+        Device to place the encoders on.
+    """
+    kwargs = dict(
+        img_size=img_size,
+        patch_size=16,
+        num_frames=num_frames,
+        tubelet_size=1,
+        in_chans=6,
+        embed_dim=768,
+        depth=12,
+        num_heads=12,
+    )
+    reference = TemporalViTEncoder(**kwargs).to(device).eval()
+    fused = TemporalViTEncoder(fused_attention=True, **kwargs).to(device).eval()
+    # Fused attention keeps the parameter names, so the state dict loads strictly
+    fused.load_state_dict(reference.state_dict(), strict=True)
+
+    return reference, fused
+
+
+def time_forward(model, x, repeats, device):
+    """
+    Return the mean latency in seconds and the peak memory in bytes of a forward.
+    ----------
+    model : nn.Module
+        Encoder to run.
+    x : torch.Tensor
+        Input of shape (B, C, T, H, W).
+    repeats : int
+        Number of timed forwards.
+    device : str
+        Device the model runs on.
+    """
+    is_cuda = torch.device(device).type == "cuda"
+    with torch.no_grad():
+        model(x)  # warmup
+        if is_cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(x)
+        if is_cuda:
+            torch.cuda.synchronize()
+        latency = (time.perf_counter() - start) / repeats
+
+    peak = torch.cuda.max_memory_allocated() if is_cuda else None
+
+    return latency, peak
+
+
+def main():
+    args = parse_args()
+    num_frames = eval(args.num_frames)
+    failed = []
+
+    for frames in num_frames:
+        reference, fused = build_encoders(frames, args.img_size, args.device)
+        x = torch.randn(args.batch_size, 6, frames, args.img_size, args.img_size).to(args.device)
+
+        with torch.no_grad():
+            diff = (reference(x)[0] - fused(x)[0]).abs().max().item()
+        if diff > args.tolerance:
+            failed.append(frames)
+        ref_time, ref_peak = time_forward(reference, x, args.repeats, args.device)
+        fused_time, fused_peak = time_forward(fused, x, args.repeats, args.device)
+
+        tokens = frames * (args.img_size // 16) ** 2 + 1
+        print(f"num_frames={frames} tokens={tokens}")
+        print(f"  max abs diff: {diff:.2e} ({'ok' if diff <= args.tolerance else 'FAIL'})")
+        print(f"  timm:  {ref_time * 1000:.1f} ms")
+        print(f"  fused: {fused_time * 1000:.1f} ms ({ref_time / fused_time:.2f}x)")
+        if ref_peak is not None:
+            print(f"  peak memory timm: {ref_peak / 2**20:.0f} MiB")
+            print(f"  peak memory fused: {fused_peak / 2**20:.0f} MiB")
+        else:
+            # Without CUDA there is no peak counter, only the size of the attention matrix
+            # the timm path materializes per block can be computed
+            attn_bytes = args.batch_size * 12 * tokens * tokens * 4
+            print(
+                f"  theoretical attention matrix per block (not measured): "
+                f"{attn_bytes / 2**20:.0f} MiB"
+            )
+
+    if failed:
+        sys.exit(f"Fused attention differs by more than {args.tolerance} for num_frames={failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,21 @@
 import argparse
+import copy
 import glob
 import os
+import queue
 import time
 
 import numpy as np
 import rasterio
 import torch
+import torch.multiprocessing as mp
 from mmcv import Config
 from mmcv.parallel import collate, scatter
 from mmseg.apis import init_segmentor
 from mmseg.datasets.pipelines import Compose, LoadImageFromFile
 from mmseg.models import build_segmentor
+from geospatial_fm import ONNXRuntimeBackend, export_onnx, quantize_segmentor, quantization_report
+from rasterio.windows import Window
 from tifffile import imread
 
 
@@ -26,8 +31,98 @@ def parse_args():
     parser.add_argument(
         "-bands", help="bands in the file where to find the relevant data", default=None
     )
+    parser.add_argument(
+        "-streaming",
+        help="read and write the images window by window to keep memory bounded",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-window_size",
+        help="size in pixels of the windows used in streaming mode",
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "-pipelined",
+        help="run readers, model and writers as separate processes connected by queues",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-readers", help="number of reader processes in pipelined mode", type=int, default=2
+    )
+    parser.add_argument(
+        "-model_workers",
+        help="number of model processes in pipelined mode",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-writers", help="number of writer processes in pipelined mode", type=int, default=2
+    )
+    parser.add_argument(
+        "-batch_size",
+        help="maximum number of images per forward pass in pipelined mode",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "-queue_size", help="maximum number of items between stages", type=int, default=8
+    )
+    parser.add_argument(
+        "-per_socket",
+        help="run one model process pinned to each CPU socket (CPU only)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-report_overhead",
+        help="report the per-file overhead removed by reusing the model and pipeline "
+        "(not available with -streaming or -pipelined)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-quantize",
+        help="run on CPU with INT8 dynamic (Linear layers) or static (also convolutions) "
+        "quantization (not available with -backend onnxruntime)",
+        choices=["dynamic", "static"],
+        default=None,
+    )
+    parser.add_argument(
+        "-calibration_input",
+        help="path to held-out images used to calibrate static quantization and in the report "
+        "(defaults to the input images)",
+        default=None,
+    )
+    parser.add_argument(
+        "-quantization_report",
+        help="report the mIoU drift and speed-up against fp32 of the -quantize mode "
+        "(dynamic by default), then predict with the quantized model (not available with "
+        "-pipelined)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-backend",
+        help="what runs the sliding windows, onnxruntime runs on CPU in fp32 and can't be "
+        "combined with -quantize",
+        choices=["pytorch", "onnxruntime"],
+        default="pytorch",
+    )
+    parser.add_argument(
+        "-onnx_model",
+        help="path to the graph written by export_onnx.py, exported there if missing",
+        default=None,
+    )
 
     args = parser.parse_args()
+    if args.report_overhead and (args.streaming or args.pipelined):
+        parser.error("-report_overhead is not available with -streaming or -pipelined")
+    if args.backend == "onnxruntime" and args.onnx_model is None:
+        parser.error("-backend onnxruntime needs -onnx_model")
+    if args.backend == "onnxruntime" and (args.quantize or args.quantization_report):
+        parser.error("-quantize and -quantization_report can't be used with -backend onnxruntime")
+    if args.pipelined and args.quantize == "static":
+        parser.error("-quantize static is not available with -pipelined")
+    if args.pipelined and args.quantization_report:
+        parser.error("-quantization_report is not available with -pipelined")
 
     return args
 
@@ -64,48 +159,123 @@ def get_meta(fname):
     return meta
 
 
+def get_cpu_sockets():
+    """
+    It groups the CPUs available to this process by socket.
+
+    :return: list with the list of CPU ids of each socket
+    """
+    sockets = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        path = f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id"
+        try:
+            with open(path) as f:
+                socket = int(f.read())
+        except (OSError, ValueError):
+            socket = 0
+        sockets.setdefault(socket, []).append(cpu)
+
+    return list(sockets.values())
+
+
+def get_windows(width, height, window_size, halo, min_size=0):
+    """
+    It splits a raster into windows to be written and their padded windows to be read.
+
+    Read windows at the edges of the raster are extended inwards so they are at least
+    min_size pixels wide and tall, as long as the raster is.
+
+    :param width: width of the raster in pixels
+    :param height: height of the raster in pixels
+    :param window_size: size of the output windows in pixels
+    :param halo: number of extra pixels read around each output window
+    :param min_size: minimum size of the read windows in pixels (e.g. the crop size)
+    :return: generator of (write_window, read_window) tuples
+    """
+
+    for row_off in range(0, height, window_size):
+        for col_off in range(0, width, window_size):
+            write_window = Window(
+                col_off,
+                row_off,
+                min(window_size, width - col_off),
+                min(window_size, height - row_off),
+            )
+
+            read_col_end = min(col_off + write_window.width + halo, width)
+            read_row_end = min(row_off + write_window.height + halo, height)
+            read_col_off = max(min(col_off - halo, read_col_end - min_size), 0)
+            read_row_off = max(min(row_off - halo, read_row_end - min_size), 0)
+            read_window = Window(
+                read_col_off,
+                read_row_off,
+                read_col_end - read_col_off,
+                read_row_end - read_row_off,
+            )
+
+            yield write_window, read_window
+
+
 def inference_segmentor(model, imgs, custom_test_pipeline=None):
     """Inference image(s) with the segmentor.
 
     Args:
         model (nn.Module): The loaded segmentor.
         imgs (str/ndarray or list[str/ndarray]): Either image files or loaded
-            images.
+            images. Loaded images need an array loader in the pipeline.
+        custom_test_pipeline (list[dict] | Compose, optional): Test pipeline
+            config, or an already built pipeline to reuse.
 
     Returns:
         (list[Tensor]): The segmentation result.
     """
     cfg = model.cfg
-    device = next(model.parameters()).device  # model device
     # build the data pipeline
     test_pipeline = (
         [LoadImageFromFile()] + cfg.data.test.pipeline[1:]
         if custom_test_pipeline == None
         else custom_test_pipeline
     )
-    test_pipeline = Compose(test_pipeline)
+    if not isinstance(test_pipeline, Compose):
+        test_pipeline = Compose(test_pipeline)
     # prepare data
     data = []
     imgs = imgs if isinstance(imgs, list) else [imgs]
     for img in imgs:
-        img_data = {"img_info": {"filename": img}}
+        if isinstance(img, np.ndarray):
+            img_data = {"img_info": {"array": img}}
+        else:
+            img_data = {"img_info": {"filename": img}}
         img_data = test_pipeline(img_data)
         data.append(img_data)
     # print(data.shape)
 
     data = collate(data, samples_per_gpu=len(imgs))
+    return segmentor_forward(model, data)
+
+
+def segmentor_forward(model, data):
+    """Run the segmentor on a collated batch.
+
+    Args:
+        model (nn.Module): The loaded segmentor.
+        data (dict): Output of ``collate`` on the test pipeline results.
+
+    Returns:
+        (list[ndarray]): The segmentation result, one mask per image.
+    """
+    device = next(model.parameters()).device  # model device
     if next(model.parameters()).is_cuda:
-        # data = collate(data, samples_per_gpu=len(imgs))
         # scatter to specified GPU
         data = scatter(data, [device])[0]
     else:
-        # img_metas = scatter(data['img_metas'],'cpu')
-        # data['img_metas'] = [i.data[0] for i in data['img_metas']]
-
         img_metas = data["img_metas"].data[0]
         img = data["img"]
         data = {"img": img, "img_metas": img_metas}
 
+    # a single list of metas for the whole batch
+    data["img_metas"] = [[meta for metas in data["img_metas"] for meta in metas]]
+
     with torch.no_grad():
         result = model(return_loss=False, rescale=True, **data)
     return result
@@ -147,11 +317,423 @@ def inference_on_file(model, target_image, output_image, custom_test_pipeline):
     return time_taken
 
 
+def inference_on_file_streaming(
+    model, target_image, output_image, custom_test_pipeline, window_size=1024
+):
+    """
+    It runs inference window by window, so memory does not grow with the size of the image.
+
+    Each window is read with a halo equal to the sliding window overlap and only its
+    interior is written to a tiled, compressed GeoTIFF.
+
+    :param model: the loaded segmentor
+    :param target_image: file path to the input image
+    :param output_image: file path to the output image
+    :param custom_test_pipeline: test pipeline starting with an array loader
+    :param window_size: size in pixels of the windows to write
+    :return: time taken in seconds (-1 if it failed)
+    """
+    time_taken = -1
+    try:
+        st = time.time()
+        print("Running streaming inference...")
+
+        halo = 0
+        min_size = 0
+        if model.test_cfg.mode == "slide":
+            halo = max(
+                model.test_cfg.crop_size[0] - model.test_cfg.stride[0],
+                model.test_cfg.crop_size[1] - model.test_cfg.stride[1],
+            )
+            # windows smaller than the crop would not be a multiple of the patch size
+            min_size = max(model.test_cfg.crop_size)
+
+        with rasterio.open(target_image, "r") as src:
+            meta = src.meta.copy()
+            meta["count"] = 1
+            meta["dtype"] = "int16"
+            meta["compress"] = "lzw"
+            meta["nodata"] = -1
+            meta["tiled"] = True
+            meta["blockxsize"] = 256
+            meta["blockysize"] = 256
+
+            with rasterio.open(output_image, "w", **meta) as dest:
+                for write_window, read_window in get_windows(
+                    src.width, src.height, window_size, halo, min_size
+                ):
+                    # to channels last, as read by tifffile
+                    img = np.moveaxis(src.read(window=read_window), 0, -1)
+                    result = inference_segmentor(model, img, custom_test_pipeline)
+
+                    row_off = write_window.row_off - read_window.row_off
+                    col_off = write_window.col_off - read_window.col_off
+                    pred = result[0][
+                        row_off : row_off + write_window.height,
+                        col_off : col_off + write_window.width,
+                    ]
+                    dest.write(pred.astype(np.int16), 1, window=write_window)
+
+        et = time.time()
+        time_taken = np.round(et - st, 1)
+        print(
+            f"Inference completed in {str(time_taken)} seconds. Output available at: "
+            + output_image
+        )
+
+    except Exception as e:
+        print(f"Error on image {target_image}: {e} \nContinue to next input")
+
+    return time_taken
+
+
+def streaming_test_pipeline(custom_test_pipeline):
+    """
+    It adapts a file based test pipeline to load the windows read in streaming mode.
+
+    :param custom_test_pipeline: test pipeline starting with a file loader
+    :return: copy of the pipeline starting with an array loader
+    """
+    streaming_pipeline = copy.deepcopy(custom_test_pipeline)
+    streaming_pipeline[0]["type"] = "LoadGeospatialImageFromArray"
+    # the windows are moved to channels last when read, whatever the layout of the files
+    streaming_pipeline[0]["channels_last"] = True
+
+    collect_index = [
+        i for i, x in enumerate(streaming_pipeline) if x["type"].find("Collect") > -1
+    ]
+
+    if len(collect_index) > 0:
+        streaming_pipeline[collect_index[0]]["type"] = "CollectTestListArray"
+        streaming_pipeline[collect_index[0]]["meta_keys"] = [
+            "img_shape",
+            "ori_shape",
+            "pad_shape",
+            "scale_factor",
+            "img_norm_cfg",
+        ]
+
+    return streaming_pipeline
+
+
+def read_worker(config_path, bands, file_queue, tensor_queue):
+    """
+    It decodes images and runs the test pipeline on them until it gets a None.
+
+    :param config_path: path to model configuration file
+    :param bands: bands in the file where to find the relevant data
+    :param file_queue: queue of (target_image, output_image) tuples
+    :param tensor_queue: queue where to put the pipeline results
+    """
+    # loading the config registers the custom pipelines in this process
+    config = Config.fromfile(config_path)
+    test_pipeline = Compose(process_test_pipeline(config.data.test.pipeline, bands))
+
+    while True:
+        item = file_queue.get()
+        if item is None:
+            break
+
+        target_image, output_image = item
+        try:
+            data = test_pipeline({"img_info": {"filename": target_image}})
+            tensor_queue.put((target_image, output_image, get_meta(target_image), data))
+        except Exception:
+            print(f"Error reading image {target_image} \nContinue to next input")
+
+
+def model_worker(
+    config_path,
+    ckpt,
+    device,
+    cpus,
+    batch_size,
+    tensor_queue,
+    output_queue,
+    quantize=None,
+    onnx_path=None,
+):
+    """
+    It batches pipeline results with the same shape and runs the model on them until it gets a None.
+
+    :param config_path: path to model configuration file
+    :param ckpt: path to model checkpoint
+    :param device: device where to load the model
+    :param cpus: CPU ids to pin the process to (None to use all)
+    :param batch_size: maximum number of images per forward pass
+    :param tensor_queue: queue with the pipeline results
+    :param output_queue: queue where to put the predictions
+    :param quantize: 'dynamic' to quantize the Linear layers to INT8 (CPU only)
+    :param onnx_path: graph run with ONNX Runtime on the sliding windows (CPU only)
+    """
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(len(cpus))
+
+    config = Config.fromfile(config_path)
+    config.model.backbone.pretrained = None
+    model = init_segmentor(config, ckpt, device=device)
+    assert quantize is None or onnx_path is None, "Quantization can't be used with ONNX Runtime"
+    if quantize == "dynamic":
+        model = quantize_segmentor(model)
+    if onnx_path is not None:
+        model.window_backend = ONNXRuntimeBackend(onnx_path, num_threads=torch.get_num_threads())
+
+    pending = None
+    done = False
+    while not done:
+        item = pending if pending is not None else tensor_queue.get()
+        pending = None
+        if item is None:
+            break
+
+        # gather what is already queued, images must share the shape to be collated
+        batch = [item]
+        shape = item[3]["img"][0].shape
+        while len(batch) < batch_size:
+            try:
+                next_item = tensor_queue.get_nowait()
+            except queue.Empty:
+                break
+            if next_item is None:
+                done = True
+                break
+            if next_item[3]["img"][0].shape != shape:
+                pending = next_item
+                break
+            batch.append(next_item)
+
+        try:
+            data = collate([x[3] for x in batch], samples_per_gpu=len(batch))
+            result = segmentor_forward(model, data)
+            for (target_image, output_image, meta, _), mask in zip(batch, result):
+                output_queue.put((target_image, output_image, meta, mask))
+        except Exception:
+            print(f"Error on images {[x[0] for x in batch]} \nContinue to next input")
+
+
+def write_worker(output_queue):
+    """
+    It compresses and writes predictions to disk until it gets a None.
+
+    :param output_queue: queue with (target_image, output_image, metadata, mask) tuples
+    """
+    while True:
+        item = output_queue.get()
+        if item is None:
+            break
+
+        target_image, output_image, meta, mask = item
+        try:
+            meta["count"] = 1
+            meta["dtype"] = "int16"
+            meta["compress"] = "lzw"
+            meta["nodata"] = -1
+            write_tiff(mask, output_image, meta)
+            print("Output available at: " + output_image)
+        except Exception:
+            print(f"Error writing image {target_image} \nContinue to next input")
+
+
+def check_pipeline(procs):
+    """
+    It stops every process of the pipeline if one of them failed.
+
+    :param procs: processes of all the stages
+    :raise RuntimeError: when a process exited with a non-zero exit code
+    """
+    failed = [proc for proc in procs if proc.exitcode not in (None, 0)]
+    if len(failed) > 0:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in procs:
+            proc.join()
+        raise RuntimeError(
+            f"Pipeline stopped: {failed[0].name} exited with code {failed[0].exitcode}"
+        )
+
+
+def join_stage(stage, procs, poll_interval=1.0):
+    """
+    It waits for the processes of a stage, checking the whole pipeline while waiting.
+
+    :param stage: processes to wait for
+    :param procs: processes of all the stages
+    :param poll_interval: seconds between checks
+    """
+    for proc in stage:
+        while proc.is_alive():
+            proc.join(timeout=poll_interval)
+            check_pipeline(procs)
+    check_pipeline(procs)
+
+
+def put_checked(item_queue, item, procs, poll_interval=1.0):
+    """
+    It puts an item on a bounded queue without blocking forever if its consumer died.
+
+    :param item_queue: queue to put the item on
+    :param item: item to put
+    :param procs: processes of all the stages
+    :param poll_interval: seconds between checks
+    """
+    while True:
+        try:
+            item_queue.put(item, timeout=poll_interval)
+            return
+        except queue.Full:
+            check_pipeline(procs)
+
+
+def inference_on_files_pipelined(
+    config_path,
+    ckpt,
+    target_images,
+    output_images,
+    bands,
+    readers=2,
+    model_workers=1,
+    writers=2,
+    batch_size=4,
+    queue_size=8,
+    per_socket=False,
+    quantize=None,
+    onnx_path=None,
+):
+    """
+    It runs inference with separate reader, model and writer processes.
+
+    Stages are connected by bounded queues, so decoding, the forward pass and
+    compression of different images overlap. If any process dies (e.g. a model
+    worker running out of memory) the whole pipeline is stopped.
+
+    :param config_path: path to model configuration file
+    :param ckpt: path to model checkpoint
+    :param target_images: list of file paths to the input images
+    :param output_images: list of file paths to the output images
+    :param bands: bands in the file where to find the relevant data
+    :param readers: number of reader processes
+    :param model_workers: number of model processes
+    :param writers: number of writer processes
+    :param batch_size: maximum number of images per forward pass
+    :param queue_size: maximum number of items between stages
+    :param per_socket: run one model process pinned to each CPU socket (CPU only)
+    :param quantize: 'dynamic' to run the model processes on CPU with INT8 Linear layers
+    :param onnx_path: graph run with ONNX Runtime on CPU by the model processes
+    :return: time taken in seconds
+    """
+    st = time.time()
+    ctx = mp.get_context("spawn")
+
+    file_queue = ctx.Queue()
+    tensor_queue = ctx.Queue(maxsize=queue_size)
+    output_queue = ctx.Queue(maxsize=queue_size)
+
+    for target_image, output_image in zip(target_images, output_images):
+        file_queue.put((target_image, output_image))
+    for _ in range(readers):
+        file_queue.put(None)
+
+    # model replicas
+    if torch.cuda.is_available() and quantize is None and onnx_path is None:
+        devices = [f"cuda:{i % torch.cuda.device_count()}" for i in range(model_workers)]
+        cpus = [None] * model_workers
+    elif per_socket:
+        cpus = get_cpu_sockets()
+        devices = ["cpu"] * len(cpus)
+    else:
+        devices = ["cpu"] * model_workers
+        cpus = [None] * model_workers
+
+    print(f"Running {readers} readers, {len(devices)} model workers and {writers} writers")
+
+    reader_procs = [
+        ctx.Process(
+            target=read_worker,
+            name=f"reader-{i}",
+            args=(config_path, bands, file_queue, tensor_queue),
+        )
+        for i in range(readers)
+    ]
+    model_procs = [
+        ctx.Process(
+            target=model_worker,
+            name=f"model-worker-{i}",
+            args=(
+                config_path,
+                ckpt,
+                device,
+                cpu_ids,
+                batch_size,
+                tensor_queue,
+                output_queue,
+                quantize,
+                onnx_path,
+            ),
+        )
+        for i, (device, cpu_ids) in enumerate(zip(devices, cpus))
+    ]
+    writer_procs = [
+        ctx.Process(target=write_worker, name=f"writer-{i}", args=(output_queue,))
+        for i in range(writers)
+    ]
+    procs = reader_procs + model_procs + writer_procs
+
+    for proc in procs:
+        proc.start()
+
+    # shut down stage by stage once the previous one is done, stopping everything if
+    # a process dies so no stage blocks forever on a full queue
+    join_stage(reader_procs, procs)
+    for _ in model_procs:
+        put_checked(tensor_queue, None, procs)
+    join_stage(model_procs, procs)
+    for _ in writer_procs:
+        put_checked(output_queue, None, procs)
+    join_stage(writer_procs, procs)
+
+    et = time.time()
+    time_taken = np.round(et - st, 1)
+    print(f"Inference on {len(target_images)} images completed in {str(time_taken)} seconds.")
+
+    return time_taken
+
+
+def get_calibration_data(cfg, input_path, input_type):
+    """
+    It lists held-out images and, when all of them have one, their ground truth masks.
+
+    Masks are looked up by replacing the img_suffix of the config with its seg_map_suffix.
+
+    :param cfg: model configuration
+    :param input_path: path to the folder with the held-out images
+    :param input_type: file type of the images
+    :return: list of image file paths and list of masks (None if any is missing)
+    """
+    img_suffix = cfg.get("img_suffix", "." + input_type)
+    seg_map_suffix = cfg.get("seg_map_suffix", None)
+    images = sorted(glob.glob(input_path + "*" + img_suffix))
+
+    if seg_map_suffix is None:
+        return images, None
+    mask_files = [image[: -len(img_suffix)] + seg_map_suffix for image in images]
+    if not all(os.path.isfile(mask_file) for mask_file in mask_files):
+        return images, None
+
+    return images, [open_tiff(mask_file) for mask_file in mask_files]
+
+
 def process_test_pipeline(custom_test_pipeline, bands=None):
+    # work on a copy so the model config is left untouched
+    custom_test_pipeline = copy.deepcopy(custom_test_pipeline)
+
     # change extracted bands if necessary
     if bands is not None:
         extract_index = [
-            i for i, x in enumerate(custom_test_pipeline) if x["type"] == "BandsExtract"
+            i
+            for i, x in enumerate(custom_test_pipeline)
+            if x["type"] in ("BandsExtract", "TorchFusedPreprocess")
         ]
 
         if len(extract_index) > 0:
@@ -179,14 +761,196 @@ def process_test_pipeline(custom_test_pipeline, bands=None):
     return custom_test_pipeline
 
 
-def inference_on_files(config_path, ckpt, input_type, input_path, output_path, bands):
-    # load model
-    config = Config.fromfile(config_path)
-    config.model.backbone.pretrained = None
-    model = init_segmentor(config, ckpt)
+class InferenceSession:
+    """
+    Model and test pipeline built once and reused for every inference call.
+
+    Building the model and the pipeline once avoids loading the checkpoint and
+    calling ``Compose`` per file.
+
+    :param config_path: path to model configuration file
+    :param ckpt: path to model checkpoint
+    :param bands: bands in the file where to find the relevant data
+    :param streaming: whether to build the array pipeline used in streaming mode
+    :param quantize: None, 'dynamic' or 'static' INT8 quantization (loads the model on CPU)
+    :param calibration_images: images used to calibrate static quantization
+    :param device: device where to load the model (CPU when quantizing, else the first GPU)
+    :param onnx_path: graph run with ONNX Runtime on the sliding windows, exported there
+        if missing (loads the model on CPU)
+    """
 
+    def __init__(
+        self,
+        config_path,
+        ckpt,
+        bands=None,
+        streaming=False,
+        quantize=None,
+        calibration_images=None,
+        device=None,
+        onnx_path=None,
+    ):
+        config = Config.fromfile(config_path)
+        config.model.backbone.pretrained = None
+        if device is None:
+            device = "cpu" if quantize or onnx_path else "cuda:0"
+        self.model = init_segmentor(config, ckpt, device=device)
+
+        if next(self.model.parameters()).is_cuda:
+            torch.backends.cudnn.benchmark = config.get("cudnn_benchmark", False)
+
+        self.custom_test_pipeline = process_test_pipeline(self.model.cfg.data.test.pipeline, bands)
+        if streaming:
+            self.custom_test_pipeline = streaming_test_pipeline(self.custom_test_pipeline)
+        self.test_pipeline = Compose(self.custom_test_pipeline)
+        # calibration and reports run on whole files
+        self.file_test_pipeline = (
+            Compose(process_test_pipeline(self.model.cfg.data.test.pipeline, bands))
+            if streaming
+            else self.test_pipeline
+        )
+
+        assert quantize is None or onnx_path is None, "Quantization can't be used with ONNX Runtime"
+        if quantize:
+            self.quantize(quantize, calibration_images)
+        if onnx_path is not None:
+            if not os.path.isfile(onnx_path):
+                export_onnx(self.model, onnx_path)
+            self.model.window_backend = ONNXRuntimeBackend(onnx_path)
+
+    def quantize(self, mode="dynamic", calibration_images=None):
+        """
+        It quantizes the model to INT8 for CPU inference.
+
+        :param mode: 'dynamic' quantizes the Linear layers of the ViT blocks, 'static'
+            also quantizes the convolutions of the neck and decode head
+        :param calibration_images: image files used to calibrate static quantization
+        :return: the quantized model
+        """
+        assert (
+            mode == "dynamic" or calibration_images
+        ), "Static quantization needs calibration images"
+
+        def calibrate():
+            for img in calibration_images:
+                inference_segmentor(self.model, img, self.file_test_pipeline)
+
+        self.model = quantize_segmentor(
+            self.model.cpu(), static_convs=mode == "static", calibrate=calibrate
+        )
+        return self.model
+
+    def quantization_report(self, imgs, gt_masks=None, mode="dynamic", calibration_images=None):
+        """
+        It quantizes the model and compares its mIoU and speed against fp32.
+
+        :param imgs: held-out image files to predict on
+        :param gt_masks: ground truth masks of the images (fp32 predictions if None)
+        :param mode: quantization mode, see quantize
+        :param calibration_images: image files used to calibrate static quantization
+        :return: dictionary with the mIoU of both models, their drift and the speed-up
+        """
+        # compare against fp32 on the same device the quantized model runs on
+        self.model = self.model.cpu()
+
+        return quantization_report(
+            lambda files: [
+                inference_segmentor(self.model, f, self.file_test_pipeline)[0] for f in files
+            ],
+            lambda: self.quantize(mode, calibration_images),
+            imgs,
+            gt_masks,
+            num_classes=self.model.decode_head.num_classes,
+            ignore_index=self.model.cfg.get("ignore_index", -1),
+        )
+
+    def __call__(self, imgs):
+        return inference_segmentor(self.model, imgs, self.test_pipeline)
+
+    def warmup(self, img):
+        """
+        It runs one untimed inference so one-off costs (lazy initialization, cuDNN
+        autotuning when enabled) are left out of later measurements.
+
+        :param img: file path or loaded image to run on
+        """
+        self(img)
+        if next(self.model.parameters()).is_cuda:
+            torch.cuda.synchronize()
+
+    def overhead_report(self, img, repeats=3):
+        """
+        It measures the per-file overhead removed by the session against rebuilding
+        the pipeline on every call.
+
+        :param img: file path or loaded image to run on
+        :param repeats: number of timed runs of each code path
+        :return: dictionary with the mean time per file of each path and their difference
+        """
+        self.warmup(img)
+
+        def mean_time(fn):
+            times = []
+            for _ in range(repeats):
+                st = time.perf_counter()
+                fn()
+                if next(self.model.parameters()).is_cuda:
+                    torch.cuda.synchronize()
+                times.append(time.perf_counter() - st)
+            return float(np.mean(times))
+
+        st = time.perf_counter()
+        Compose(self.custom_test_pipeline)
+        build_time = time.perf_counter() - st
+
+        per_call = mean_time(
+            lambda: inference_segmentor(self.model, img, self.custom_test_pipeline)
+        )
+        session = mean_time(lambda: self(img))
+
+        report = {
+            "per_call": per_call,
+            "session": session,
+            "overhead": per_call - session,
+            "pipeline_build": build_time,
+        }
+        print(
+            f"Per file: {per_call:.3f}s rebuilding the pipeline, {session:.3f}s with the "
+            f"session ({report['overhead'] * 1000:.1f} ms removed, "
+            f"{build_time * 1000:.1f} ms of it building the pipeline)"
+        )
+        return report
+
+
+def inference_on_files(
+    config_path,
+    ckpt,
+    input_type,
+    input_path,
+    output_path,
+    bands,
+    streaming=False,
+    window_size=1024,
+    pipelined=False,
+    readers=2,
+    model_workers=1,
+    writers=2,
+    batch_size=4,
+    queue_size=8,
+    per_socket=False,
+    report_overhead=False,
+    quantize=None,
+    calibration_input=None,
+    report_quantization=False,
+    backend="pytorch",
+    onnx_path=None,
+):
     # identify images to predict on
     target_images = glob.glob(input_path + "*." + input_type)
+    output_images = [
+        output_path + target_image.split("/")[-1].replace("." + input_type, "_pred." + input_type)
+        for target_image in target_images
+    ]
 
     print("Identified images to predict on: " + str(len(target_images)))
 
@@ -194,17 +958,71 @@ def inference_on_files(config_path, ckpt, input_type, input_path, output_path, b
     if not os.path.isdir(output_path):
         os.mkdir(output_path)
 
-    # modify test pipeline if necessary
-    custom_test_pipeline = process_test_pipeline(model.cfg.data.test.pipeline, bands)
+    # the combinations of options are checked by parse_args
+    if backend != "onnxruntime":
+        onnx_path = None
+
+    if pipelined:
+        if onnx_path is not None and not os.path.isfile(onnx_path):
+            export_onnx(InferenceSession(config_path, ckpt, bands, device="cpu").model, onnx_path)
+        inference_on_files_pipelined(
+            config_path,
+            ckpt,
+            target_images,
+            output_images,
+            bands,
+            readers,
+            model_workers,
+            writers,
+            batch_size,
+            queue_size,
+            per_socket,
+            quantize,
+            onnx_path,
+        )
+        return
+
+    # held-out images default to the input images
+    calibration_input = calibration_input or input_path
+
+    # load model and build the test pipeline once
+    if report_quantization:
+        # the report measures the fp32 model on CPU and then quantizes it
+        session = InferenceSession(config_path, ckpt, bands, streaming, device="cpu")
+        images, gt_masks = get_calibration_data(session.model.cfg, calibration_input, input_type)
+        # calibrate on every 4th image and report on the rest
+        held_out = [i for i in range(len(images)) if i % 4 != 0] or list(range(len(images)))
+        session.quantization_report(
+            [images[i] for i in held_out],
+            [gt_masks[i] for i in held_out] if gt_masks is not None else None,
+            quantize or "dynamic",
+            images[::4],
+        )
+    else:
+        calibration_images = (
+            get_calibration_data(Config.fromfile(config_path), calibration_input, input_type)[0]
+            if quantize == "static"
+            else None
+        )
+        session = InferenceSession(
+            config_path, ckpt, bands, streaming, quantize, calibration_images, onnx_path=onnx_path
+        )
+    model = session.model
+    custom_test_pipeline = session.test_pipeline
+
+    if report_overhead and len(target_images) > 0:
+        session.overhead_report(target_images[0])
 
     # for each image predict and save to disk
-    for i, target_image in enumerate(target_images):
+    for i, (target_image, output_image) in enumerate(zip(target_images, output_images)):
         print(f"Working on Image {i}")
-        output_image = output_path + target_image.split("/")[-1].replace(
-            "." + input_type, "_pred." + input_type
-        )
 
-        inference_on_file(model, target_image, output_image, custom_test_pipeline)
+        if streaming:
+            inference_on_file_streaming(
+                model, target_image, output_image, custom_test_pipeline, window_size
+            )
+        else:
+            inference_on_file(model, target_image, output_image, custom_test_pipeline)
 
 
 def main():
@@ -216,8 +1034,32 @@ def main():
     input_path = args.input
     output_path = args.output
     bands = args.bands
+    streaming = args.streaming
+    window_size = args.window_size
 
-    inference_on_files(config_path, ckpt, input_type, input_path, output_path, bands)
+    inference_on_files(
+        config_path,
+        ckpt,
+        input_type,
+        input_path,
+        output_path,
+        bands,
+        streaming,
+        window_size,
+        args.pipelined,
+        args.readers,
+        args.model_workers,
+        args.writers,
+        args.batch_size,
+        args.queue_size,
+        args.per_socket,
+        args.report_overhead,
+        args.quantize,
+        args.calibration_input,
+        args.quantization_report,
+        args.backend,
+        args.onnx_model,
+    )
 
 
 if __name__ == "__main__":
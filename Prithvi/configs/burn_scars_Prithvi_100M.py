@@ -238,7 +238,8 @@ model = dict(
         depth=12,
         num_heads=num_heads,
         mlp_ratio=4.0,
-        norm_pix_loss=False
+        norm_pix_loss=False,
+        fused_attention=False
     ),
     neck=dict(
         type="ConvTransformerTokensToEmbeddingNeck",
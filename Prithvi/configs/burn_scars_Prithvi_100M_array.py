@@ -166,7 +166,8 @@ model = dict(
         depth=12,
         num_heads=num_heads,
         mlp_ratio=4.0,
-        norm_pix_loss=False
+        norm_pix_loss=False,
+        fused_attention=False
     ),
     neck=dict(
         type="ConvTransformerTokensToEmbeddingNeck",
@@ -207,6 +208,7 @@ model = dict(
         mode="slide",
         stride=(int(tile_size / 2), int(tile_size / 2)),
         crop_size=(tile_size, tile_size),
+        slide_batch_size=8,
     ),
 )
 gpu_ids = range(0, 1)
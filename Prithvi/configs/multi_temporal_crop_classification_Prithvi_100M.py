@@ -197,7 +197,8 @@ model = dict(
         depth=6,
         num_heads=num_heads,
         mlp_ratio=4.0,
-        norm_pix_loss=False),
+        norm_pix_loss=False,
+        fused_attention=False),
     neck=dict(
         type='ConvTransformerTokensToEmbeddingNeck',
         embed_dim=embed_dim*num_frames,
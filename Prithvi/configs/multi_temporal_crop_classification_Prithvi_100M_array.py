@@ -161,7 +161,8 @@ model = dict(
         depth=6,
         num_heads=num_heads,
         mlp_ratio=4.0,
-        norm_pix_loss=False),
+        norm_pix_loss=False,
+        fused_attention=False),
     neck=dict(
         type='ConvTransformerTokensToEmbeddingNeck',
         embed_dim=embed_dim*num_frames,
@@ -194,5 +195,9 @@ model = dict(
         align_corners=False,
         loss_decode=loss_func),
     train_cfg=dict(),
-    test_cfg=dict(mode='slide', stride=(int(tile_size/2), int(tile_size/2)), crop_size=(tile_size, tile_size)))
+    test_cfg=dict(
+        mode='slide',
+        stride=(int(tile_size/2), int(tile_size/2)),
+        crop_size=(tile_size, tile_size),
+        slide_batch_size=8))
 auto_resume = False
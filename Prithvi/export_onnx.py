@@ -0,0 +1,46 @@
+import argparse
+
+from mmcv import Config
+from mmseg.apis import init_segmentor
+
+from geospatial_fm import export_onnx, get_window_shape
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Export the encode/decode graph of a model for ONNX Runtime"
+    )
+    parser.add_argument("-config", help="path to model configuration file")
+    parser.add_argument("-ckpt", help="path to model checkpoint")
+    parser.add_argument("-output", help="path of the .onnx file to write")
+    parser.add_argument(
+        "-window_size",
+        help="height and width of the windows, defaults to the crop_size of the config",
+        type=int,
+        default=None,
+    )
+    parser.add_argument("-opset", help="ONNX opset version", type=int, default=14)
+    parser.add_argument(
+        "-atol", help="absolute tolerance against PyTorch", type=float, default=1e-4
+    )
+    parser.add_argument(
+        "-rtol", help="relative tolerance against PyTorch", type=float, default=1e-3
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    config = Config.fromfile(args.config)
+    config.model.backbone.pretrained = None
+    if args.window_size is not None:
+        config.model.test_cfg.crop_size = (args.window_size, args.window_size)
+    model = init_segmentor(config, args.ckpt, device="cpu")
+
+    export_onnx(model, args.output, get_window_shape(model), args.opset, args.atol, args.rtol)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,11 @@
-from .geospatial_fm import ConvTransformerTokensToEmbeddingNeck, TemporalViTEncoder, GeospatialNeck
+from .geospatial_fm import (
+    ConvTransformerTokensToEmbeddingNeck,
+    TemporalViTEncoder,
+    GeospatialNeck,
+    FusedAttention
+)
+from .onnx_backend import export_onnx, ONNXRuntimeBackend, get_window_shape
+from .quantization import quantize_segmentor, quantization_report, StaticQuantConv
 from .geospatial_pipelines import (
     TorchRandomCrop,
     LoadGeospatialAnnotations,
@@ -8,7 +15,8 @@ from .geospatial_pipelines import (
     CastTensor,
     CollectTestList,
     CollectTestListArray,
-    TorchPermute
+    TorchPermute,
+    TorchFusedPreprocess
 )
 from .datasets import GeospatialDataset
 from .temporal_encoder_decoder import TemporalEncoderDecoder
@@ -27,5 +35,13 @@ __all__ = [
     "CollectTestList",
     "CollectTestListArray",
     "GeospatialNeck",
-    "TorchPermute"
+    "TorchPermute",
+    "TorchFusedPreprocess",
+    "FusedAttention",
+    "quantize_segmentor",
+    "quantization_report",
+    "StaticQuantConv",
+    "export_onnx",
+    "ONNXRuntimeBackend",
+    "get_window_shape"
 ]
@@ -9,7 +9,8 @@
 # DeiT: https://github.com/facebookresearch/deit
 # --------------------------------------------------------
 
-import numpy as np
+from functools import lru_cache
+
 import torch
 import torch.nn as nn
 from einops import rearrange
@@ -41,6 +42,15 @@ def _convTranspose2dOutput(
     )
 
 
+def _get_patch_grid(features: tuple, default: tuple):
+    """
+    Return the (height, width) in patches of the tokens of a backbone output.
+    TemporalViTEncoder passes the patch grid of its input after the tokens, other
+    backbones are expected to run on the configured grid.
+    """
+    return tuple(features[1]) if len(features) > 1 else default
+
+
 def get_1d_sincos_pos_embed_from_grid(embed_dim: int, pos: torch.Tensor):
     """
     embed_dim: output dimension for each position
@@ -48,21 +58,25 @@ def get_1d_sincos_pos_embed_from_grid(embed_dim: int, pos: torch.Tensor):
     out: (M, D)
     """
     assert embed_dim % 2 == 0
-    omega = np.arange(embed_dim // 2, dtype=np.float32)
+    omega = torch.arange(embed_dim // 2, dtype=torch.float32, device=pos.device)
     omega /= embed_dim / 2.0
     omega = 1.0 / 10000**omega  # (D/2,)
 
-    pos = pos.reshape(-1)  # (M,)
-    out = np.einsum("m,d->md", pos, omega)  # (M, D/2), outer product
+    pos = pos.reshape(-1).float()  # (M,)
+    out = torch.outer(pos, omega)  # (M, D/2), outer product
 
-    emb_sin = np.sin(out)  # (M, D/2)
-    emb_cos = np.cos(out)  # (M, D/2)
-
-    emb = np.concatenate([emb_sin, emb_cos], axis=1)  # (M, D)
+    emb = torch.cat([torch.sin(out), torch.cos(out)], dim=1)  # (M, D)
     return emb
 
 
-def get_3d_sincos_pos_embed(embed_dim: int, grid_size: tuple, cls_token: bool = False):
+@lru_cache(maxsize=32)
+def get_3d_sincos_pos_embed(
+    embed_dim: int,
+    grid_size: tuple,
+    cls_token: bool = False,
+    dtype: torch.dtype = torch.float32,
+    device: torch.device = None,
+):
     # Copyright (c) Meta Platforms, Inc. and affiliates.
     # All rights reserved.
 
@@ -75,6 +89,9 @@ def get_3d_sincos_pos_embed(embed_dim: int, grid_size: tuple, cls_token: bool =
     grid_size: 3d tuple of grid size: t, h, w
     return:
     pos_embed: L, D
+
+    Results are cached per (embed_dim, grid_size, cls_token, dtype, device), so the
+    returned tensor is shared and must not be modified in place.
     """
 
     assert embed_dim % 16 == 0
@@ -85,19 +102,25 @@ def get_3d_sincos_pos_embed(embed_dim: int, grid_size: tuple, cls_token: bool =
     h_embed_dim = embed_dim // 16 * 6
     t_embed_dim = embed_dim // 16 * 4
 
-    w_pos_embed = get_1d_sincos_pos_embed_from_grid(w_embed_dim, np.arange(w_size))
-    h_pos_embed = get_1d_sincos_pos_embed_from_grid(h_embed_dim, np.arange(h_size))
-    t_pos_embed = get_1d_sincos_pos_embed_from_grid(t_embed_dim, np.arange(t_size))
-
-    w_pos_embed = np.tile(w_pos_embed, (t_size * h_size, 1))
-    h_pos_embed = np.tile(np.repeat(h_pos_embed, w_size, axis=0), (t_size, 1))
-    t_pos_embed = np.repeat(t_pos_embed, h_size * w_size, axis=0)
-
-    pos_embed = np.concatenate((w_pos_embed, h_pos_embed, t_pos_embed), axis=1)
+    positions = torch.arange(max(grid_size), device=device)
+    w_pos_embed = get_1d_sincos_pos_embed_from_grid(w_embed_dim, positions[:w_size])
+    h_pos_embed = get_1d_sincos_pos_embed_from_grid(h_embed_dim, positions[:h_size])
+    t_pos_embed = get_1d_sincos_pos_embed_from_grid(t_embed_dim, positions[:t_size])
+
+    # broadcast each axis over the (t, h, w) grid instead of tiling copies
+    grid = (t_size, h_size, w_size)
+    pos_embed = torch.cat(
+        (
+            w_pos_embed[None, None, :, :].expand(*grid, -1),
+            h_pos_embed[None, :, None, :].expand(*grid, -1),
+            t_pos_embed[:, None, None, :].expand(*grid, -1),
+        ),
+        dim=-1,
+    ).reshape(-1, embed_dim)
 
     if cls_token:
-        pos_embed = np.concatenate([np.zeros([1, embed_dim]), pos_embed], axis=0)
-    return pos_embed
+        pos_embed = torch.cat([pos_embed.new_zeros(1, embed_dim), pos_embed], dim=0)
+    return pos_embed.to(dtype)
 
 
 class PatchEmbed(nn.Module):
@@ -144,11 +167,8 @@ class PatchEmbed(nn.Module):
     def forward(self, x):
         B, C, T, H, W = x.shape
         assert (
-            H == self.img_size[0]
-        ), f"Input image height ({H}) doesn't match model ({self.img_size[0]})."
-        assert (
-            W == self.img_size[1]
-        ), f"Input image width ({W}) doesn't match model ({self.img_size[1]})."
+            H % self.patch_size[0] == 0 and W % self.patch_size[1] == 0
+        ), f"Input image size ({H}x{W}) must be a multiple of the patch size {self.patch_size}."
         x = self.proj(x)
         Hp, Wp = x.shape[3], x.shape[4]
         if self.flatten:
@@ -157,6 +177,57 @@ class PatchEmbed(nn.Module):
         return x, Hp, Wp
 
 
+class FusedAttention(nn.Module):
+    """Multi-head self-attention computed with torch scaled_dot_product_attention.
+
+    Drop-in replacement for timm's Attention: it keeps the qkv and proj layer names, so
+    existing checkpoints load unchanged, but lets torch pick the memory-efficient or flash
+    kernel instead of materializing the full N x N attention matrix.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        num_heads: int = 8,
+        qkv_bias: bool = False,
+        attn_drop: float = 0.0,
+        proj_drop: float = 0.0,
+    ):
+        super().__init__()
+        assert hasattr(
+            nn.functional, "scaled_dot_product_attention"
+        ), "Fused attention needs torch>=2.0 (scaled_dot_product_attention)."
+        self.num_heads = num_heads
+        self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
+        self.attn_drop = attn_drop
+        self.proj = nn.Linear(dim, dim)
+        self.proj_drop = nn.Dropout(proj_drop)
+
+    @classmethod
+    def from_attention(cls, attn: nn.Module):
+        """Build from a timm Attention, sharing its layers"""
+        fused = cls(attn.qkv.in_features, attn.num_heads, attn.qkv.bias is not None)
+        fused.qkv = attn.qkv
+        fused.proj = attn.proj
+        fused.attn_drop = attn.attn_drop.p
+        fused.proj_drop = attn.proj_drop
+        return fused
+
+    def forward(self, x):
+        batch_size, num_tokens, dim = x.shape
+        qkv = self.qkv(x).reshape(batch_size, num_tokens, 3, self.num_heads, -1)
+        q, k, v = qkv.permute(2, 0, 3, 1, 4).unbind(0)  # 3 x (B, heads, N, head_dim)
+
+        x = nn.functional.scaled_dot_product_attention(
+            q, k, v, dropout_p=self.attn_drop if self.training else 0.0
+        )
+
+        x = x.transpose(1, 2).reshape(batch_size, num_tokens, dim)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x
+
+
 class Norm2d(nn.Module):
     def __init__(self, embed_dim: int):
         super().__init__()
@@ -193,6 +264,7 @@ class GeospatialNeck(nn.Module):
             embed_dim (int): Input embedding dimension
             first_conv_channel (int): Number of channels for first dimension
             Hp (int, optional): Height (in patches) of embedding to be upscaled. Defaults to 14.
+                Inputs of other sizes use the patch grid passed by the backbone.
             Wp (int, optional): Width (in patches) of embedding to be upscaled. Defaults to 14.
             channel_reduction_factor (int): Factor that each convolutional block reduces number of channels by.
             num_convs (int): Number of convolutional upscaling blocks. Each upscales 2x.
@@ -256,15 +328,16 @@ class GeospatialNeck(nn.Module):
         ])
 
     def forward(self, x):
+        hp, wp = _get_patch_grid(x, (self.Hp, self.Wp))
         x = x[0]
         if self.drop_cls_token:
             x = x[:, 1:, :]
-        x = x.permute(0, 2, 1).reshape(x.shape[0], -1, self.Hp, self.Wp)
+        x = x.permute(0, 2, 1).reshape(x.shape[0], -1, hp, wp)
 
         for layer in self.layers:
             x = layer(x)
 
-        x = x.reshape((x.shape[0], self.channels[-1], self.H_out, self.W_out))
+        x = x.reshape((x.shape[0], self.channels[-1], x.shape[-2], x.shape[-1]))
 
         out = tuple([x])
 
@@ -292,6 +365,7 @@ class ConvTransformerTokensToEmbeddingNeck(nn.Module):
             embed_dim (int): Input embedding dimension
             output_embed_dim (int): Output embedding dimension
             Hp (int, optional): Height (in patches) of embedding to be upscaled. Defaults to 14.
+                Inputs of other sizes use the patch grid passed by the backbone.
             Wp (int, optional): Width (in patches) of embedding to be upscaled. Defaults to 14.
             drop_cls_token (bool, optional): Whether there is a cls_token, which should be dropped. This assumes the cls token is the first token. Defaults to True.
         """
@@ -364,15 +438,16 @@ class ConvTransformerTokensToEmbeddingNeck(nn.Module):
         )
 
     def forward(self, x):
+        hp, wp = _get_patch_grid(x, (self.Hp, self.Wp))
         x = x[0]
         if self.drop_cls_token:
             x = x[:, 1:, :]
-        x = x.permute(0, 2, 1).reshape(x.shape[0], -1, self.Hp, self.Wp)
+        x = x.permute(0, 2, 1).reshape(x.shape[0], -1, hp, wp)
 
         x = self.fpn1(x)
         x = self.fpn2(x)
 
-        x = x.reshape((-1, self.output_embed_dim, self.H_out, self.W_out))
+        x = x.reshape((-1, self.output_embed_dim, x.shape[-2], x.shape[-1]))
 
         out = tuple([x])
 
@@ -383,7 +458,8 @@ class ConvTransformerTokensToEmbeddingNeck(nn.Module):
 class TemporalViTEncoder(nn.Module):
     """Encoder from an ViT with capability to take in temporal input.
 
-    This class defines an encoder taken from a ViT architecture.
+    This class defines an encoder taken from a ViT architecture. It returns the tokens
+    and the (height, width) in patches of the input, which the necks lay them out on.
     """
 
     def __init__(
@@ -399,7 +475,8 @@ class TemporalViTEncoder(nn.Module):
         mlp_ratio: float = 4.0,
         norm_layer: nn.Module = nn.LayerNorm,
         norm_pix_loss: bool = False,
-        pretrained: str = None
+        pretrained: str = None,
+        fused_attention: bool = False,
     ):
         """
 
@@ -416,6 +493,8 @@ class TemporalViTEncoder(nn.Module):
             norm_layer (nn.Module, optional): Norm layer to be used. Defaults to nn.LayerNorm.
             norm_pix_loss (bool, optional): Whether to use Norm Pix Loss. Defaults to False.
             pretrained (str, optional): Path to pretrained encoder weights. Defaults to None.
+            fused_attention (bool, optional): Whether to compute attention with torch
+                scaled_dot_product_attention. Defaults to False.
         """
         super().__init__()
 
@@ -445,10 +524,15 @@ class TemporalViTEncoder(nn.Module):
                 for _ in range(depth)
             ]
         )
+        if fused_attention:
+            for blk in self.blocks:
+                blk.attn = FusedAttention.from_attention(blk.attn)
         self.norm = norm_layer(embed_dim)
 
         self.norm_pix_loss = norm_pix_loss
         self.pretrained = pretrained
+        # pos_embed interpolated to other patch grids, keyed by (t, h, w, dtype, device)
+        self._pos_embed_cache = {}
 
         self.initialize_weights()
 
@@ -456,9 +540,13 @@ class TemporalViTEncoder(nn.Module):
         # initialization
         # initialize (and freeze) pos_embed by sin-cos embedding
         pos_embed = get_3d_sincos_pos_embed(
-            self.pos_embed.shape[-1], self.patch_embed.grid_size, cls_token=True
+            self.pos_embed.shape[-1],
+            tuple(self.patch_embed.grid_size),
+            cls_token=True,
+            dtype=self.pos_embed.dtype,
+            device=self.pos_embed.device,
         )
-        self.pos_embed.data.copy_(torch.from_numpy(pos_embed).float().unsqueeze(0))
+        self.pos_embed.data.copy_(pos_embed.unsqueeze(0))
 
         # initialize patch_embed like nn.Linear (instead of nn.Conv2d)
         w = self.patch_embed.proj.weight.data
@@ -483,15 +571,57 @@ class TemporalViTEncoder(nn.Module):
             nn.init.constant_(m.bias, 0)
             nn.init.constant_(m.weight, 1.0)
 
+    def _load_from_state_dict(self, *args, **kwargs):
+        # a new pos_embed invalidates its interpolations
+        self._pos_embed_cache.clear()
+        super()._load_from_state_dict(*args, **kwargs)
+
+    def interpolate_pos_embed(self, t: int, h: int, w: int):
+        """Return pos_embed for a grid of t x h x w patches.
+
+        The embedding of the configured grid is resized (bicubic over space, linear over
+        time) and cached, so each window shape is only interpolated once.
+
+        Args:
+            t (int): Number of patches along time.
+            h (int): Number of patches along height.
+            w (int): Number of patches along width.
+        """
+        if (t, h, w) == tuple(self.patch_embed.grid_size):
+            return self.pos_embed
+
+        key = (t, h, w, self.pos_embed.dtype, self.pos_embed.device)
+        if key not in self._pos_embed_cache:
+            grid_t, grid_h, grid_w = self.patch_embed.grid_size
+            pos_embed = self.pos_embed.detach()
+            patch_pos_embed = pos_embed[0, 1:].reshape(grid_t, grid_h, grid_w, -1)
+            patch_pos_embed = patch_pos_embed.permute(0, 3, 1, 2)
+            patch_pos_embed = nn.functional.interpolate(
+                patch_pos_embed, size=(h, w), mode="bicubic", align_corners=False
+            )  # T, D, h, w
+            if t != grid_t:
+                patch_pos_embed = nn.functional.interpolate(
+                    patch_pos_embed.permute(1, 0, 2, 3).unsqueeze(0),
+                    size=(t, h, w),
+                    mode="trilinear",
+                    align_corners=False,
+                )[0].permute(1, 0, 2, 3)  # t, D, h, w
+            patch_pos_embed = patch_pos_embed.permute(0, 2, 3, 1).reshape(1, t * h * w, -1)
+            self._pos_embed_cache[key] = torch.cat((pos_embed[:, :1], patch_pos_embed), dim=1)
+
+        return self._pos_embed_cache[key]
+
     def forward(self, x):
         # embed patches
-        x, _, _ = self.patch_embed(x)
+        t = x.shape[2] // self.patch_embed.tubelet_size
+        x, hp, wp = self.patch_embed(x)
+        pos_embed = self.interpolate_pos_embed(t, hp, wp)
 
         # add pos embed w/o cls token
-        x = x + self.pos_embed[:, 1:, :]
+        x = x + pos_embed[:, 1:, :]
 
         # append cls token
-        cls_token = self.cls_token + self.pos_embed[:, :1, :]
+        cls_token = self.cls_token + pos_embed[:, :1, :]
         cls_tokens = cls_token.expand(x.shape[0], -1, -1)
         x = torch.cat((cls_tokens, x), dim=1)
 
@@ -501,4 +631,5 @@ class TemporalViTEncoder(nn.Module):
 
         x = self.norm(x)
 
-        return tuple([x])
+        # the necks need the patch grid to lay the tokens out again
+        return tuple([x, (hp, wp)])
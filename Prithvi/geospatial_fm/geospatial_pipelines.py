@@ -146,17 +146,82 @@ class Reshape(object):
         dim_to_infer = np.where(np.array(self.new_shape) == -1)[0]
 
         for key in self.keys:
+            new_shape = self.new_shape
             if (len(dim_to_infer) > 1) & (self.look_up is not None):
                 old_shape = results[key].shape
                 tmp = np.array(self.new_shape)
                 for i in range(len(dim_to_infer)):
                     tmp[dim_to_infer[i]] = old_shape[self.look_up[str(dim_to_infer[i])]]
-                self.new_shape = tuple(tmp)
-            results[key] = results[key].reshape(self.new_shape)
+                new_shape = tuple(tmp)
+            results[key] = results[key].reshape(new_shape)
 
         return results
 
 
+@PIPELINES.register_module()
+class TorchFusedPreprocess(object):
+    """Fused band extraction, float32 cast, permutation, normalization and reshape.
+
+    It replaces the BandsExtract, ToTensor, TorchPermute, TorchNormalize, Reshape and
+    CastTensor chain. Each extracted band is read once and written once, normalized and
+    cast to float32, into a preallocated tensor. Takes a channels last image (H, W, C) or
+    batch of images (N, H, W, C) and returns (C / num_frames, num_frames, H, W) or
+    (N, C / num_frames, num_frames, H, W).
+
+    Args:
+        means (sequence): Mean values of the extracted bands.
+        stds (sequence): Std values of the extracted bands.
+        bands (list, optional): The list of indexes to extract. If not provided all are used.
+        num_frames (int, optional): Number of frames (temporal dimension). Defaults to 1.
+        keys (list, optional): Keys to apply it to. Defaults to ["img"].
+    """
+
+    def __init__(self, means, stds, bands=None, num_frames=1, keys=("img",)):
+        self.means = means
+        self.stds = stds
+        self.bands = bands
+        self.num_frames = num_frames
+        self.keys = keys
+        # (x - mean) / std as x * scale + shift
+        self.scale = [1.0 / std for std in stds]
+        self.shift = [
+            torch.tensor(-mean / std, dtype=torch.float32) for mean, std in zip(means, stds)
+        ]
+
+    def __call__(self, results):
+        for key in self.keys:
+            img = results[key]
+            img = torch.as_tensor(img)
+            batched = img.dim() == 4
+            if not batched:
+                img = img.unsqueeze(0)
+
+            # channels first view, no copy
+            img = img.permute(0, 3, 1, 2)
+            bands = self.bands if self.bands is not None else range(img.shape[1])
+
+            out = torch.empty(
+                (img.shape[0], len(bands), img.shape[2], img.shape[3]), dtype=torch.float32
+            )
+            for i, band in enumerate(bands):
+                # shift + scale * x in one kernel, cast on the fly into out
+                torch.add(self.shift[i], img[:, band], alpha=self.scale[i], out=out[:, i])
+
+            out = out.reshape(
+                out.shape[0], -1, self.num_frames, out.shape[2], out.shape[3]
+            )
+            results[key] = out if batched else out[0]
+
+        results["img_norm_cfg"] = dict(mean=self.means, std=self.stds)
+        return results
+
+    def __repr__(self):
+        return (
+            self.__class__.__name__
+            + f"(keys={self.keys}, bands={self.bands}, num_frames={self.num_frames})"
+        )
+
+
 @PIPELINES.register_module()
 class CastTensor(object):
     """
@@ -390,7 +455,7 @@ class LoadGeospatialImageFromArray(object):
         if self.nodata is not None:
             img = np.where(img == self.nodata, self.nodata_replace, img)
 
-        results["img"] = results["img_info"]["array"]
+        results["img"] = img
         results["img_shape"] = img.shape
         results["ori_shape"] = img.shape
         # Set initial values for default meta_keys
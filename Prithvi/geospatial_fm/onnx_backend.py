@@ -0,0 +1,117 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class EncodeDecodeGraph(nn.Module):
+    """Encode/decode step of a segmentor on one batch of windows, as exported to ONNX.
+
+    The sliding window orchestration stays in Python, only what runs per window is
+    part of the graph.
+    """
+
+    def __init__(self, segmentor: nn.Module):
+        super().__init__()
+        self.segmentor = segmentor
+
+    def forward(self, img):
+        return self.segmentor.encode_decode(img, [])
+
+
+def get_window_shape(model: nn.Module):
+    """Return the (C, T, H, W) shape of the windows a slide-mode segmentor runs on.
+
+    Args:
+        model (nn.Module): Segmentor with a TemporalViTEncoder backbone.
+    """
+    assert model.test_cfg.mode == "slide", "Only slide inference runs on fixed windows."
+    h_crop, w_crop = model.test_cfg.crop_size
+    in_chans = model.backbone.patch_embed.proj.in_channels
+    return (in_chans, model.backbone.num_frames, h_crop, w_crop)
+
+
+def export_onnx(
+    model: nn.Module,
+    output_path: str,
+    window_shape: Optional[Tuple[int, int, int, int]] = None,
+    opset_version: int = 14,
+    atol: float = 1e-4,
+    rtol: float = 1e-3,
+):
+    """Export the encode/decode graph of a segmentor for a fixed window shape.
+
+    The batch dimension is left dynamic so the last, smaller, mini-batch of windows
+    runs on the same graph. After exporting, the graph is run with ONNX Runtime on a
+    random batch and checked against the PyTorch output.
+
+    Args:
+        model (nn.Module): Segmentor on CPU.
+        output_path (str): Path of the .onnx file to write.
+        window_shape (tuple, optional): (C, T, H, W) shape of the windows. Defaults to
+            the shape of the slide windows of the model.
+        opset_version (int, optional): ONNX opset. Defaults to 14.
+        atol (float, optional): Absolute tolerance of the check. Defaults to 1e-4.
+        rtol (float, optional): Relative tolerance of the check. Defaults to 1e-3.
+
+    Returns:
+        float: Maximum absolute difference between ONNX Runtime and PyTorch logits.
+    """
+    if window_shape is None:
+        window_shape = get_window_shape(model)
+
+    graph = EncodeDecodeGraph(model).eval()
+    img = torch.randn(2, *window_shape, device=next(model.parameters()).device)
+    with torch.no_grad():
+        torch.onnx.export(
+            graph,
+            img,
+            output_path,
+            input_names=["img"],
+            output_names=["seg_logit"],
+            dynamic_axes={"img": {0: "batch"}, "seg_logit": {0: "batch"}},
+            opset_version=opset_version,
+        )
+        expected = graph(img).cpu().numpy()
+
+    actual = ONNXRuntimeBackend(output_path)(img).cpu().numpy()
+    np.testing.assert_allclose(actual, expected, rtol=rtol, atol=atol)
+    max_diff = float(np.abs(actual - expected).max())
+    print(f"Exported {output_path} for windows of shape {window_shape}")
+    print(f"Max abs difference with PyTorch: {max_diff:.2e}")
+
+    return max_diff
+
+
+class ONNXRuntimeBackend:
+    """Runs an exported encode/decode graph with ONNX Runtime on CPU.
+
+    Args:
+        onnx_path (str): Path to the graph written by export_onnx.
+        num_threads (int, optional): Intra-op threads, ONNX Runtime picks when None.
+    """
+
+    def __init__(self, onnx_path: str, num_threads: Optional[int] = None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnxruntime backend needs `pip install onnxruntime`.")
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        # (C, T, H, W) the graph was exported for
+        self.window_shape = tuple(self.session.get_inputs()[0].shape[1:])
+
+    def accepts(self, img: torch.Tensor):
+        return tuple(img.shape[1:]) == self.window_shape
+
+    def __call__(self, img: torch.Tensor):
+        array = img.detach().cpu().numpy().astype(np.float32, copy=False)
+        (seg_logit,) = self.session.run(None, {self.input_name: array})
+        return torch.from_numpy(seg_logit).to(img.device)
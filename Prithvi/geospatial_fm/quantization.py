@@ -0,0 +1,163 @@
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+from mmcv.cnn import ConvModule
+from mmseg.core.evaluation import mean_iou
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+class StaticQuantConv(nn.Module):
+    """Convolution run in INT8 between a quantize and a dequantize step.
+
+    The surrounding layers (LayerNorm, GELU, ...) have no quantized kernels, so each
+    convolution quantizes its own input and hands float activations back.
+    """
+
+    def __init__(self, conv: nn.Module):
+        super().__init__()
+        self.quant = torch.quantization.QuantStub()
+        self.conv = conv
+        self.dequant = torch.quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.conv(self.quant(x)))
+
+
+def _static_qconfig():
+    # per-tensor weights, supported by both Conv2d and ConvTranspose2d on every engine
+    return torch.quantization.QConfig(
+        activation=torch.quantization.HistogramObserver.with_args(reduce_range=True),
+        weight=torch.quantization.default_weight_observer,
+    )
+
+
+def _wrap_convs(module: nn.Module):
+    for name, child in module.named_children():
+        if isinstance(child, StaticQuantConv):
+            continue
+        if isinstance(child, (nn.Conv2d, nn.ConvTranspose2d)):
+            wrapped = StaticQuantConv(child)
+            wrapped.qconfig = _static_qconfig()
+            setattr(module, name, wrapped)
+        else:
+            _wrap_convs(child)
+
+
+def _fuse_conv_bn(module: nn.Module):
+    for child in module.modules():
+        if isinstance(child, ConvModule) and isinstance(child.norm, nn.BatchNorm2d):
+            child.conv = fuse_conv_bn_eval(child.conv, child.norm)
+            setattr(child, child.norm_name, nn.Identity())
+
+
+def quantize_segmentor(
+    model: nn.Module,
+    static_convs: bool = False,
+    calibrate: Optional[Callable[[], None]] = None,
+):
+    """Quantize a segmentor in place for INT8 inference on CPU.
+
+    The Linear layers of the backbone are dynamically quantized to INT8. Optionally,
+    the convolutions of the neck and decode head are statically quantized, which needs
+    calibration data to be run through the model.
+
+    Args:
+        model (nn.Module): Segmentor on CPU, e.g. a TemporalEncoderDecoder.
+        static_convs (bool, optional): Whether to statically quantize the convolutions of
+            the neck and decode head. Defaults to False.
+        calibrate (Callable, optional): Runs inference on calibration samples with
+            the model. Required when static_convs is True. Defaults to None.
+
+    Returns:
+        nn.Module: The quantized model.
+    """
+    assert not next(model.parameters()).is_cuda, "Quantized inference only runs on CPU."
+    model.eval()
+
+    if static_convs:
+        assert calibrate is not None, "Static quantization needs calibration samples."
+        engines = torch.backends.quantized.supported_engines
+        torch.backends.quantized.engine = "fbgemm" if "fbgemm" in engines else "qnnpack"
+
+        heads = [model.decode_head] + ([model.neck] if getattr(model, "with_neck", False) else [])
+        for head in heads:
+            _fuse_conv_bn(head)
+            _wrap_convs(head)
+            torch.quantization.prepare(head, inplace=True)
+        with torch.no_grad():
+            calibrate()
+        for head in heads:
+            torch.quantization.convert(head, inplace=True)
+
+    torch.quantization.quantize_dynamic(
+        model.backbone, {nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+    return model
+
+
+def quantization_report(
+    predict: Callable[[List], List[np.ndarray]],
+    quantize: Callable[[], None],
+    samples: List,
+    gt_seg_maps: Optional[List[np.ndarray]] = None,
+    num_classes: int = 2,
+    ignore_index: int = -1,
+):
+    """Compare the accuracy and speed of a model before and after quantizing it.
+
+    The samples are predicted with the fp32 model, the model is quantized and the
+    samples are predicted again. Without ground truth, the mIoU of the quantized model
+    is measured against the fp32 predictions.
+
+    Args:
+        predict (Callable): Returns one mask per sample with the current model.
+        quantize (Callable): Quantizes the model used by predict.
+        samples (list): Held-out samples to predict on.
+        gt_seg_maps (list[np.ndarray], optional): Ground truth masks. Defaults to None.
+        num_classes (int, optional): Number of classes. Defaults to 2.
+        ignore_index (int, optional): Label ignored in the metrics. Defaults to -1.
+
+    Returns:
+        dict: mIoU of both models, their drift, latency per sample and speed-up.
+    """
+    predict(samples[:1])  # warmup
+    st = time.perf_counter()
+    fp32_masks = predict(samples)
+    fp32_time = (time.perf_counter() - st) / len(samples)
+
+    quantize()
+
+    predict(samples[:1])
+    st = time.perf_counter()
+    int8_masks = predict(samples)
+    int8_time = (time.perf_counter() - st) / len(samples)
+
+    def miou(results, references):
+        iou = mean_iou(results, references, num_classes, ignore_index)["IoU"]
+        return float(np.nanmean(iou))
+
+    references = gt_seg_maps if gt_seg_maps is not None else fp32_masks
+    report = {
+        "fp32_miou": miou(fp32_masks, references),
+        "int8_miou": miou(int8_masks, references),
+        "fp32_time": fp32_time,
+        "int8_time": int8_time,
+        "speedup": fp32_time / int8_time,
+    }
+    report["miou_drift"] = report["int8_miou"] - report["fp32_miou"]
+
+    reference_name = "ground truth" if gt_seg_maps is not None else "fp32 predictions"
+    print(
+        f"mIoU against {reference_name} on {len(samples)} samples: "
+        f"fp32 {report['fp32_miou']:.4f}, int8 {report['int8_miou']:.4f} "
+        f"(drift {report['miou_drift']:+.4f})"
+    )
+    print(
+        f"Time per sample: fp32 {fp32_time * 1000:.1f} ms, int8 {int8_time * 1000:.1f} ms "
+        f"({report['speedup']:.2f}x)"
+    )
+    return report
@@ -19,7 +19,8 @@ class TemporalEncoderDecoder(EncoderDecoder):
     Note that auxiliary_head is only used for deep supervision during training,
     which could be dumped during inference.
 
-    The backbone should return plain embeddings.
+    The backbone should return plain embeddings, followed by their patch grid
+    for inputs of another size than the configured one.
     The neck can process these to make them suitable for the chosen heads.
     The heads perform the final processing that will return the output.
     """
@@ -54,6 +55,10 @@ class TemporalEncoderDecoder(EncoderDecoder):
         self.test_cfg = test_cfg
         assert self.with_decode_head
 
+        # optional callable running the windows of slide inference instead of
+        # encode_decode, e.g. an ONNXRuntimeBackend
+        self.window_backend = None
+
     def encode_decode(self, img, img_metas):
         """Encode images with backbone and decode into a semantic segmentation
         map of the same size as input."""
@@ -69,17 +74,35 @@ class TemporalEncoderDecoder(EncoderDecoder):
             mode='bilinear',
             align_corners=self.align_corners)
         return out
-      
+
+    def window_forward(self, crop_img, img_meta):
+        """Encode/decode a batch of windows, with the window backend if it
+        accepts their shape."""
+        backend = self.window_backend
+        if backend is not None and backend.accepts(crop_img):
+            return backend(crop_img)
+        return self.encode_decode(crop_img, img_meta)
+
     def slide_inference(self, img, img_meta, rescale):
         """Inference by sliding-window with overlap.
 
         If h_crop > h_img or w_crop > w_img, the small patch will be used to
         decode without padding.
+
+        Crops are gathered into mini-batches of ``test_cfg.slide_batch_size``
+        windows (defaults to 1) so the backbone, neck and head run once per
+        mini-batch. The logits of each mini-batch are then accumulated back
+        into the full image with a single ``index_add_`` over the flattened
+        pixel indices of its windows.
+
+        Mini-batches go through ``window_forward``, so a ``window_backend``
+        can run them while the sliding stays in Python.
         """
 
         h_stride, w_stride = self.test_cfg.stride
         h_crop, w_crop = self.test_cfg.crop_size
-        
+        slide_batch_size = self.test_cfg.get('slide_batch_size', 1)
+
         #### size and bactch size over last two dimensions ###
         img_size = img.size()
         batch_size = img_size[0]
@@ -88,8 +111,9 @@ class TemporalEncoderDecoder(EncoderDecoder):
         out_channels = self.out_channels
         h_grids = max(h_img - h_crop + h_stride - 1, 0) // h_stride + 1
         w_grids = max(w_img - w_crop + w_stride - 1, 0) // w_stride + 1
-        preds = img.new_zeros((batch_size, out_channels, h_img, w_img))
-        count_mat = img.new_zeros((batch_size, 1, h_img, w_img))
+
+        # window corners, all windows share the same (clamped) size
+        windows = []
         for h_idx in range(h_grids):
             for w_idx in range(w_grids):
                 y1 = h_idx * h_stride
@@ -98,23 +122,42 @@ class TemporalEncoderDecoder(EncoderDecoder):
                 x2 = min(x1 + w_crop, w_img)
                 y1 = max(y2 - h_crop, 0)
                 x1 = max(x2 - w_crop, 0)
-                
-                if len(img_size) == 4:
-                    
-                    crop_img = img[:, :, y1:y2, x1:x2]
-                
-                elif len(img_size) == 5:
-                    
-                    crop_img = img[:, :, :, y1:y2, x1:x2]
-                
-                
-                
-                crop_seg_logit = self.encode_decode(crop_img, img_meta)
-                preds += F.pad(crop_seg_logit,
-                               (int(x1), int(preds.shape[3] - x2), int(y1),
-                                int(preds.shape[2] - y2)))
-
-                count_mat[:, :, y1:y2, x1:x2] += 1
+                windows.append((y1, x1))
+        h_win = min(h_crop, h_img)
+        w_win = min(w_crop, w_img)
+
+        # flat pixel indices of a window in the (h_img * w_img) plane are
+        # its corner plus these offsets, built per mini-batch only
+        rows = torch.arange(h_win, device=img.device)
+        cols = torch.arange(w_win, device=img.device)
+        offsets = (rows[:, None] * w_img + cols[None, :]).reshape(-1)
+        corners = torch.tensor(
+            [y1 * w_img + x1 for y1, x1 in windows], device=img.device)
+
+        preds = img.new_zeros((batch_size, out_channels, h_img * w_img))
+        count_mat = img.new_zeros((1, 1, h_img, w_img))
+        for y1, x1 in windows:
+            count_mat[..., y1:y1 + h_win, x1:x1 + w_win] += 1
+
+        for start in range(0, len(windows), slide_batch_size):
+            batch_windows = windows[start:start + slide_batch_size]
+            num_windows = len(batch_windows)
+
+            #### crops over last two dimensions, stacked window-major ###
+            crop_img = torch.cat([
+                img[..., y1:y1 + h_win, x1:x1 + w_win]
+                for y1, x1 in batch_windows
+            ], dim=0)
+
+            crop_seg_logit = self.window_forward(crop_img, img_meta)
+            crop_seg_logit = crop_seg_logit.reshape(
+                num_windows, batch_size, out_channels, h_win * w_win)
+            crop_seg_logit = crop_seg_logit.permute(1, 2, 0, 3).reshape(
+                batch_size, out_channels, num_windows * h_win * w_win)
+            indices = corners[start:start + num_windows, None] + offsets[None, :]
+            preds.index_add_(2, indices.reshape(-1), crop_seg_logit)
+
+        preds = preds.reshape(batch_size, out_channels, h_img, w_img)
         assert (count_mat == 0).sum() == 0
         if torch.onnx.is_in_onnx_export():
             # cast count_mat to constant while exporting to ONNX
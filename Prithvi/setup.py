@@ -17,5 +17,6 @@ setup(
         "timm==0.4.12",
         "tensorboard",
         "imagecodecs"
-    ]
+    ],
+    extras_require={"onnx": ["onnx", "onnxruntime"]}
 )
\ No newline at end of file
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import math
+import os
+import threading
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+
+def dataset_metadata(src):
+    """
+    Header of an open dataset needed to read windows of it, as a JSON-serializable dict.
+    ----------
+    src : rasterio dataset
+    """
+    return {
+        "crs": src.crs.to_wkt(),
+        "transform": list(src.transform)[:6],
+        "width": src.width,
+        "height": src.height,
+        "count": src.count,
+        "dtype": src.dtypes[0],
+        "res": list(src.res),
+        "nodata": src.nodata,
+        "scale": src.scales[0],
+    }
+
+
+class COGTileCache:
+    """
+    On-disk cache of the internal tiles of COGs, keyed by href, overview level and tile index.
+    Tiles are stored as .npy files and read back memory-mapped, next to the header and
+    overview layout of their COG, so reads fully covered by the cache make no requests.
+    Files are written atomically and misses are fetched again, so several processes can
+    share the same folder.
+    ----------
+    path : str
+        Folder where the tiles are stored
+    max_bytes : int
+        Maximum size of the cache, the least recently used tiles are evicted first when a
+        write goes over it
+    """
+
+    def __init__(self, path="~/.cache/hls_data_project/cog_tiles", max_bytes=2 * 1024**3):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Size of the tiles on disk, measured on the first write and then tracked
+        self._size = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def _href_dir(self, href):
+        return os.path.join(self.path, hashlib.sha1(href.encode()).hexdigest())
+
+    def _tile_path(self, href, level, row, col):
+        return os.path.join(self._href_dir(href), f"{level}_{row}_{col}.npy")
+
+    def _write_atomic(self, path, write):
+        # Write to a temporary file and rename it, so readers never see partial files
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def metadata(self, href):
+        """
+        Header of the COG and the size and tiling of each of its overview levels. Only the
+        first call for an href opens it, the result is cached next to its tiles.
+        """
+        path = os.path.join(self._href_dir(href), "metadata.json")
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        with rio.open(href) as src:
+            metadata = dataset_metadata(src)
+            metadata["overviews"] = src.overviews(1)
+            levels = [{"width": src.width, "height": src.height,
+                       "block_shape": list(src.block_shapes[0])}]
+            for level in range(len(metadata["overviews"])):
+                with rio.open(href, overview_level=level) as overview:
+                    levels.append({"width": overview.width, "height": overview.height,
+                                   "block_shape": list(overview.block_shapes[0])})
+            # levels[0] is the full resolution, levels[i + 1] the overview level i
+            metadata["levels"] = levels
+
+        self._write_atomic(path, lambda f: f.write(json.dumps(metadata).encode()))
+        return metadata
+
+    def _get_tile(self, open_level, href, level, row, col, level_meta):
+        path = self._tile_path(href, level, row, col)
+        try:
+            tile = np.load(path, mmap_mode="r")
+            # Mark the tile as recently used
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return tile
+        except (OSError, ValueError):
+            # Missing, or removed/being written by another process
+            pass
+
+        with self._lock:
+            self.misses += 1
+        block_height, block_width = level_meta["block_shape"]
+        tile_window = Window(
+            col * block_width,
+            row * block_height,
+            min(block_width, level_meta["width"] - col * block_width),
+            min(block_height, level_meta["height"] - row * block_height),
+        )
+        tile = open_level(level).read(window=tile_window)
+
+        self._write_atomic(path, lambda f: np.save(f, tile))
+        self._track_write(os.path.getsize(path))
+
+        return tile
+
+    def read(self, href, window, out_shape):
+        """
+        Read a window of the COG at href through the cache, like src.read(window, out_shape).
+        The overview matching out_shape is read and resampled to it by nearest neighbour.
+        The COG is only opened if some of the tiles are not cached.
+        """
+        metadata = self.metadata(href)
+
+        # Overview matching the decimation
+        decimation = min(window.width / out_shape[2], window.height / out_shape[1])
+        level, factor = -1, 1
+        for i, overview in enumerate(metadata["overviews"]):
+            if overview <= decimation:
+                level, factor = i, overview
+        level_meta = metadata["levels"][level + 1]
+
+        # Datasets opened on the first tile missing at each level
+        datasets = {}
+
+        def open_level(level):
+            if level not in datasets:
+                datasets[level] = (
+                    rio.open(href) if level < 0 else rio.open(href, overview_level=level)
+                )
+            return datasets[level]
+
+        try:
+            # Window at the overview resolution
+            col_off, row_off = window.col_off // factor, window.row_off // factor
+            level_window = Window(
+                col_off,
+                row_off,
+                math.ceil((window.col_off + window.width) / factor) - col_off,
+                math.ceil((window.row_off + window.height) / factor) - row_off,
+            ).intersection(Window(0, 0, level_meta["width"], level_meta["height"]))
+
+            block_height, block_width = level_meta["block_shape"]
+            row_start = int(level_window.row_off)
+            row_stop = row_start + int(level_window.height)
+            col_start = int(level_window.col_off)
+            col_stop = col_start + int(level_window.width)
+
+            data = np.empty(
+                (metadata["count"], row_stop - row_start, col_stop - col_start),
+                dtype=metadata["dtype"],
+            )
+            for row in range(row_start // block_height, math.ceil(row_stop / block_height)):
+                for col in range(col_start // block_width, math.ceil(col_stop / block_width)):
+                    tile = self._get_tile(open_level, href, level, row, col, level_meta)
+
+                    # Intersection of the tile and the window in dataset pixels
+                    tile_y, tile_x = row * block_height, col * block_width
+                    y0, y1 = max(tile_y, row_start), min(tile_y + tile.shape[1], row_stop)
+                    x0, x1 = max(tile_x, col_start), min(tile_x + tile.shape[2], col_stop)
+                    data[:, y0 - row_start : y1 - row_start, x0 - col_start : x1 - col_start] = (
+                        tile[:, y0 - tile_y : y1 - tile_y, x0 - tile_x : x1 - tile_x]
+                    )
+        finally:
+            for dataset in datasets.values():
+                dataset.close()
+
+        if data.shape != tuple(out_shape):
+            rows = (np.arange(out_shape[1]) * data.shape[1] / out_shape[1]).astype(int)
+            cols = (np.arange(out_shape[2]) * data.shape[2] / out_shape[2]).astype(int)
+            data = data[:, rows][:, :, cols]
+
+        return data
+
+    def _tiles(self):
+        """(mtime, size, path) of every tile on disk"""
+        tiles = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    tiles.append((stat.st_mtime, stat.st_size, path))
+        return tiles
+
+    def _track_write(self, nbytes):
+        """Add a written tile to the tracked size, evicting if it goes over max_bytes"""
+        with self._lock:
+            if self._size is None:
+                # The new tile is already on disk
+                self._size = sum(size for _, size, _ in self._tiles())
+            else:
+                self._size += nbytes
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used tiles until the cache fits in max_bytes"""
+        tiles = self._tiles()
+
+        total = sum(size for _, size, _ in tiles)
+        for _, size, path in sorted(tiles):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+        # Other processes may share the folder, so resync with what is on disk
+        with self._lock:
+            self._size = total
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,6 +1,14 @@
+import glob
+import io
+import json
+import math
 import os
-import subprocess
-import urllib.request
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 from netrc import netrc
 from sys import platform
 
@@ -9,34 +17,181 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pyproj
 import rasterio as rio
-from rasterio import mask
+import shapely
+from rasterio.features import geometry_mask
+from rasterio.windows import Window, from_bounds
 from ipywidgets import interact
 from osgeo import gdal
 from PIL import Image, ImageDraw, ImageFont
-from shapely.ops import transform
 
 from data_params import GEEData
+from cog_tile_cache import dataset_metadata
+from thumbnail_fetcher import thumbnail_fetcher
+from video_encoder import encode_video
+
+
+@lru_cache(maxsize=32)
+def get_transformer(crs):
+    """Cached transformer from WGS84 longitude/latitude to crs"""
+    return pyproj.Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+def reproject_polygons(polygons, crs):
+    """
+    Reproject one or many WGS84 geometries to crs in a single vectorized call.
+    ----------
+    polygons : shapely geometry or array-like of geometries
+    crs : str or CRS
+        Destination coordinate system
+    """
+    transformer = get_transformer(str(crs))
+
+    def _transform(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack((x, y))
+
+    return shapely.transform(polygons, _transform)
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    """Cached Roboto font of the given size"""
+    return ImageFont.truetype("../data/raw/Roboto-Regular.ttf", size)
+
+
+@lru_cache(maxsize=1024)
+def render_text_mask(text, size):
+    """Cached alpha mask (0-255) of text rendered in white, anchored at its top-left corner"""
+    font = get_font(size)
+    _, _, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (max(right, 1), max(bottom, 1)), 0)
+    ImageDraw.Draw(mask).text((0, 0), text, fill=255, font=font)
+
+    mask = np.array(mask)
+    mask.flags.writeable = False
+    return mask
+
+
+# GDAL configurations used to access LP DAAC Cloud Assets via vsicurl, with HTTP/2
+# multiplexing, merged range requests and block caches to reuse connections and bytes
+COG_IO_DEFAULTS = {
+    "GDAL_HTTP_COOKIEFILE": "~/cookies.txt",
+    "GDAL_HTTP_COOKIEJAR": "~/cookies.txt",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": "TIF",
+    # Keep track of the bytes downloaded per file
+    "CPL_VSIL_NETWORK_STATS_ENABLED": "YES",
+    "GDAL_HTTP_VERSION": "2",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": str(64 * 1024 * 1024),
+    "GDAL_CACHEMAX": "512",
+}
+
+# Options in use by the process, empty until configure_cog_io is called
+_cog_io_options = {}
+_cog_io_lock = threading.Lock()
+
+
+def configure_cog_io(force=False, **options):
+    """
+    Set the process-wide GDAL configuration for COG reads. Only the first call (or one with
+    new options or force) touches GDAL, so every COGExtractor shares the same curl cache and
+    connections.
+    ----------
+    options : str
+        GDAL configuration options overriding COG_IO_DEFAULTS, e.g. VSI_CACHE_SIZE="268435456"
+    """
+    with _cog_io_lock:
+        if _cog_io_options and not force and not options:
+            return dict(_cog_io_options)
+
+        config = {**COG_IO_DEFAULTS, **{key: str(value) for key, value in options.items()}}
+        try:
+            for key, value in config.items():
+                gdal.SetConfigOption(key, value)
+            # The block cache size is read once, so it is also set directly (MB)
+            gdal.SetCacheMax(int(config["GDAL_CACHEMAX"]) * 1024 * 1024)
+            print("GDAL configurations set successfully.")
+        except Exception as e:
+            print("Failed to set GDAL configurations:", str(e))
+
+        _cog_io_options.clear()
+        _cog_io_options.update(config)
+        return dict(config)
+
+
+def benchmark_cog_io(items, polygon, settings, repeats=3, **get_data_kwargs):
+    """
+    Compare latency and bytes fetched per granule across GDAL settings. Items may point to a
+    local COG server (e.g. `python -m http.server` on a folder of HLS COGs) so results do not
+    depend on the network.
+    ----------
+    items : list of dict
+        STAC items with the HLS band assets
+    polygon : shapely.geometry.Polygon
+        Area of interest in WGS84
+    settings : dict of dict
+        Name and GDAL options (see configure_cog_io) of each configuration to compare
+    repeats : int
+        Number of extractions of each item per configuration
+    """
+    results = {}
+    for name, options in settings.items():
+        configure_cog_io(force=True, **options)
+        latencies, transferred = [], []
+        for _ in range(repeats):
+            # Start every run with cold curl caches
+            gdal.VSICurlClearCache()
+            for item in items:
+                extractor = COGExtractor(item, polygon)
+                st = time.perf_counter()
+                extractor.get_data(**get_data_kwargs)
+                latencies.append(time.perf_counter() - st)
+                transferred.append(sum(extractor.band_bytes.values()))
+
+        results[name] = {
+            "latency_s": float(np.mean(latencies)),
+            "bytes": float(np.mean(transferred)),
+        }
+        print(
+            f"{name}: {results[name]['latency_s']:.3f} s and "
+            f"{results[name]['bytes'] / 1e6:.2f} MB per granule"
+        )
+
+    # Leave the defaults in place
+    configure_cog_io(force=True)
+    return results
+
+
+def encode_png(frame, compress_level=6, optimize=False):
+    """PNG bytes of a (H, W, C) uint8 frame"""
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(
+        buffer, format="PNG", compress_level=compress_level, optimize=optimize
+    )
+    return buffer.getvalue()
 
 
 class COGExtractor:
-    def __init__(self, item, polygon):
+    def __init__(self, item, polygon, tile_cache=None):
+        """
+        tile_cache : COGTileCache
+            Optional on-disk cache of the COG tiles, reused by later extractions
+        """
         self.item = item
         self.polygon = polygon
-        self.gdal_config()
-        self.authenticate()
+        self.tile_cache = tile_cache
+        # The GDAL environment and credentials are set up once per process
+        if not _cog_io_options:
+            self.authenticate()
+        configure_cog_io()
 
-    def gdal_config(self):
+    def gdal_config(self, **options):
         """GDAL configurations used to successfully access
         LP DAAC Cloud Assets via vsicurl"""
-        try:
-            # Set GDAL configurations
-            gdal.SetConfigOption("GDAL_HTTP_COOKIEFILE", "~/cookies.txt")
-            gdal.SetConfigOption("GDAL_HTTP_COOKIEJAR", "~/cookies.txt")
-            gdal.SetConfigOption("GDAL_DISABLE_READDIR_ON_OPEN", "EMPTY_DIR")
-            gdal.SetConfigOption("CPL_VSIL_CURL_ALLOWED_EXTENSIONS", "TIF")
-            print("GDAL configurations set successfully.")
-        except Exception as e:
-            print("Failed to set GDAL configurations:", str(e))
+        return configure_cog_io(force=True, **options)
 
     def authenticate(self):
         # Earthdata URL to call for authentication
@@ -56,14 +211,109 @@ class COGExtractor:
             print(f"{nrc} file not found.")
 
     def polygon_utm(self, bands_crs):
-        # Source coordinate system of the ROI
-        geo_crs = pyproj.Proj("+proj=longlat +datum=WGS84 +no_defs", preserve_units=True)
-        # Destination coordinate system
-        utm = pyproj.Proj(bands_crs)  # Destination coordinate system
-        project = pyproj.Transformer.from_proj(geo_crs, utm)  # Set up the transformation
-        return transform(project.transform, self.polygon)
-
-    def get_data(self, normalize=False):
+        # Reproject the ROI from WGS84 to the coordinate system of the bands
+        return reproject_polygons(self.polygon, bands_crs)
+
+    def _read_band(self, band_link, resolution=None):
+        """
+        Read only the window of a band covering the ROI. With a tile cache, the header and
+        the tiles already cached are read from disk, otherwise the band is opened over vsicurl.
+        """
+        if self.tile_cache is not None:
+            metadata = self.tile_cache.metadata(band_link)
+            return self._clip_band(
+                metadata,
+                resolution,
+                lambda window, out_shape: self.tile_cache.read(band_link, window, out_shape),
+            )
+
+        with rio.open(band_link) as src:
+            return self._clip_band(
+                dataset_metadata(src),
+                resolution,
+                lambda window, out_shape: src.read(window=window, out_shape=out_shape),
+            )
+
+    def _clip_band(self, metadata, resolution, read):
+        """
+        Read the window of the polygon bounds and mask the pixels outside the polygon.
+        ----------
+        metadata : dict
+            Header of the band, see dataset_metadata
+        resolution : float
+            Target resolution in meters
+        read : callable
+            read(window, out_shape) returning the pixels of the window
+        """
+        polygon = self.polygon_utm(metadata["crs"])
+        transform = rio.Affine(*metadata["transform"])
+        width, height = metadata["width"], metadata["height"]
+        res_x, res_y = metadata["res"]
+        nodata = metadata["nodata"]
+
+        # Pixel window of the polygon bounds, snapped outwards to whole pixels
+        window = from_bounds(*polygon.bounds, transform=transform)
+        col_off, row_off = math.floor(window.col_off), math.floor(window.row_off)
+        window = Window(
+            col_off,
+            row_off,
+            math.ceil(window.col_off + window.width) - col_off,
+            math.ceil(window.row_off + window.height) - row_off,
+        ).intersection(Window(0, 0, width, height))
+
+        # Read from the overview matching the target resolution
+        out_height, out_width = window.height, window.width
+        if resolution is not None and resolution > res_x:
+            out_height = max(1, round(window.height * res_y / resolution))
+            out_width = max(1, round(window.width * res_x / resolution))
+        data = read(window, (metadata["count"], out_height, out_width))
+
+        # Mask the pixels outside the polygon within the window
+        window_transform = rio.windows.transform(window, transform) * rio.Affine.scale(
+            window.width / out_width, window.height / out_height
+        )
+        outside = geometry_mask(
+            [polygon], out_shape=(out_height, out_width), transform=window_transform
+        )
+        data[:, outside] = nodata if nodata is not None else 0
+
+        return data, nodata, metadata["scale"]
+
+    @staticmethod
+    def _downloaded_bytes(stats, href):
+        """Sum the bytes downloaded for href in the GDAL network statistics"""
+        total = 0
+        for key, value in stats.items():
+            if not isinstance(value, dict):
+                continue
+            if key == "files":
+                for file_name, file_stats in value.items():
+                    file_name = file_name.replace("/vsicurl/", "")
+                    if file_name.endswith(href) or href.endswith(file_name):
+                        total += sum(
+                            method.get("downloaded_bytes", 0)
+                            for method in file_stats.get("methods", {}).values()
+                        )
+            else:
+                total += COGExtractor._downloaded_bytes(value, href)
+        return total
+
+    def get_data(self, normalize=False, max_workers=6, resolution=None, dtype="float64"):
+        """
+        Read the six HLS bands of the item clipped to the polygon.
+        ----------
+        normalize : Boolean
+            If True applies the scale factor of each band
+        max_workers : int
+            Number of bands fetched concurrently. Use 1 to read them one at a time.
+        resolution : float
+            Target resolution in meters. If coarser than the native one, data is read
+            from the matching overview.
+        dtype : str
+            "float64" or "float32" to get nodata as nan, with the scale factor applied in
+            place if normalize. "int16" keeps the raw values, with the nodata pixels in
+            band_masks and the scale factor in band_scales (normalize is ignored).
+        """
         band_links = {}
         # Define which HLS product is being accessed
         if self.item["collection"] == "HLSS30.v2.0":
@@ -93,42 +343,71 @@ class COGExtractor:
             if any(b == a for b in bands):
                 band_links[a] = self.item["assets"][a]["href"]
 
-        # Use vsicurl to load the data directly into memory (be patient, may take a few seconds)
-        band_metadata = {}
-        for band_name, band_link in band_links.items():
-            band_metadata[band_name] = rio.open(band_link)
-
-        # Extract the data for the ROI and clip to that bbox
-        band_data = {}
-        bands_crs = band_metadata[bands[0]].crs
-        for band_name, data in band_metadata.items():
-            data, _transform = rio.mask.mask(data, [self.polygon_utm(bands_crs)], crop=True)
-            band_data[band_name] = data.astype(float)
-
-        # Set all nodata values to nan
-        for band_name, data in band_data.items():
-            band_data[band_name][band_data[band_name] == band_metadata[band_name].nodata] = np.nan
-
-        # Grab scale factor from metadata and apply to each band
+        # Use vsicurl to load the data directly into memory, extract the data for the ROI
+        # and clip to that bbox. Bands are fetched concurrently, keeping their order.
+        gdal.NetworkStatsReset()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda band_link: self._read_band(band_link, resolution), band_links.values()
+            )
+            band_data, band_nodata, band_scales = {}, {}, {}
+            for band_name, (data, nodata, scale) in zip(band_links.keys(), results):
+                band_data[band_name] = data
+                band_nodata[band_name] = nodata
+                band_scales[band_name] = scale
+
+        # Bytes transferred per band
+        stats = json.loads(gdal.NetworkStatsGetAsSerializedJSON() or "{}")
+        self.band_bytes = {
+            band_name: self._downloaded_bytes(stats, band_link)
+            for band_name, band_link in band_links.items()
+        }
+
+        # Set all nodata values to nan (or keep them in a mask) and grab scale factor
+        # from metadata to apply to each band
         self.band_scales = {}
+        self.band_masks = {}
         for band_name, data in band_data.items():
-            if normalize:
-                band_data[band_name] = band_data[band_name][0] * band_metadata[band_name].scales[0]
-                self.band_scales[band_name] = 1
+            data = data[0]
+            nodata = data == band_nodata[band_name]
+            if dtype == "int16":
+                data = data.astype(np.int16, copy=False)
+                self.band_masks[band_name] = nodata
+                self.band_scales[band_name] = band_scales[band_name]
             else:
-                band_data[band_name] = band_data[band_name][0]
-                self.band_scales[band_name] = band_metadata[band_name].scales[0]
+                data = data.astype(dtype)
+                data[nodata] = np.nan
+                if normalize:
+                    data *= band_scales[band_name]
+                    self.band_scales[band_name] = 1
+                else:
+                    self.band_scales[band_name] = band_scales[band_name]
+            band_data[band_name] = data
 
         # Rename bands
         band_data = {band_names[key]: value for key, value in band_data.items()}
         self.band_scales = {band_names[key]: value for key, value in self.band_scales.items()}
+        self.band_bytes = {band_names[key]: value for key, value in self.band_bytes.items()}
+        self.band_masks = {band_names[key]: value for key, value in self.band_masks.items()}
 
         return band_data
 
     @staticmethod
-    def get_input_array(band_data):
+    def get_input_array(band_data, out=None):
+        """
+        Stack the bands into a (H, W, 6) array.
+        ----------
+        out : np.ndarray
+            Optional preallocated (H, W, 6) buffer to write into. By default one is
+            created with the dtype of the bands.
+        """
         band_list = ["blue", "green", "red", "nir", "swir_1", "swir_2"]
-        return np.stack(tuple([band_data[band] for band in band_list]), axis=-1)
+        if out is None:
+            first = band_data[band_list[0]]
+            out = np.empty(first.shape + (len(band_list),), dtype=first.dtype)
+        for i, band in enumerate(band_list):
+            out[..., i] = band_data[band]
+        return out
 
     def display_composites(self, band_data):
         fig, ax = plt.subplots(1, 2, figsize=(16, 8))
@@ -163,85 +442,115 @@ class GEEExtractor:
         # Area of Interest
         self.region = self.geometry.get("features")[0].get("geometry").get("coordinates")
 
-    def get_composites(self, scale=30, dimensions=None, alpha_channel=False):
+    def _thumbnail_url(self, instrument, image, scale=30, dimensions=None):
+        gee_data = GEEData(instrument)
+
+        if dimensions:
+            image = image.reproject(crs="EPSG:4326", scale=gee_data.scale)
+            visSave = {
+                "dimensions": dimensions,
+                "format": "png",
+                "crs": "EPSG:3857",
+                "region": self.region,
+            }
+        else:
+            visSave = {"scale": scale, "region": self.region, "crs": "EPSG:3857"}
+
+        # Get thumbnail url
+        return image.visualize(**gee_data.swir_vis).getThumbURL(visSave)
+
+    def _fetch_thumbnails(self, scale=30, dimensions=None, max_workers=8):
         """
-        Create Numpy array with 1 composite per year.
-        ----------
-        dimensions : int
-            A number or pair of numbers in format WIDTHxHEIGHT Maximum dimensions of the thumbnail to render, in pixels. If only one number is passed, it is used as the maximum, and the other dimension is computed by proportional scaling.
-        alpha_channel : Boolean
-            If True adds transparency
+        Thumbnail of the first instrument of each date, keeping dates and instruments.
+        The getThumbURL round trips run on the download threads, so both are concurrent.
         """
-
         self.dates = []
         self.instruments = []
-        for n, (date, image_dict) in enumerate(self.images.items()):
+        sources = []
+        for date, image_dict in self.images.items():
             self.dates.append(date)
             instrument, image = list(image_dict.items())[0]
             self.instruments.append(instrument)
+            sources.append((instrument, image))
 
-            gee_data = GEEData(instrument)
-
-            if dimensions:
-                image = image.reproject(crs="EPSG:4326", scale=self.scale)
-                visSave = {
-                    "dimensions": dimensions,
-                    "format": "png",
-                    "crs": "EPSG:3857",
-                    "region": self.region,
-                }
-            else:
-                visSave = {"scale": scale, "region": self.region, "crs": "EPSG:3857"}
+        return thumbnail_fetcher.fetch_many(
+            sources,
+            max_workers,
+            get_url=lambda source: self._thumbnail_url(*source, scale, dimensions),
+        )
 
-            # Get thumbnail url
-            thumbnail_url = image.visualize(**gee_data.swir_vis).getThumbURL(visSave)
+    @staticmethod
+    def _fill_frame(frame, array, alpha_channel=False):
+        """Copy a decoded thumbnail into frame, setting the alpha channel in place"""
+        frame[..., :3] = array[..., :3]
+        if alpha_channel:
+            frame[..., 3] = array[..., 3] if array.shape[-1] == 4 else 255
+        return frame
+
+    def iter_composites(self, scale=30, dimensions=None, alpha_channel=False, max_workers=8):
+        """
+        Generator of the composites, one frame at a time in date order.
+        Thumbnail urls are requested and downloaded concurrently. Same arguments as
+        get_composites.
+        """
+        channels = 4 if alpha_channel else 3
+        for array in self._fetch_thumbnails(scale, dimensions, max_workers):
+            frame = np.empty(array.shape[:2] + (channels,), dtype=np.uint8)
+            yield self._fill_frame(frame, array, alpha_channel)
 
-            # Open the URL and read the image using PIL
-            with urllib.request.urlopen(thumbnail_url) as response:
-                array = np.array(Image.open(response))
+    def get_composites(self, scale=30, dimensions=None, alpha_channel=False, max_workers=8):
+        """
+        Create Numpy array with 1 composite per year.
+        ----------
+        dimensions : int
+            A number or pair of numbers in format WIDTHxHEIGHT Maximum dimensions of the thumbnail to render, in pixels. If only one number is passed, it is used as the maximum, and the other dimension is computed by proportional scaling.
+        alpha_channel : Boolean
+            If True adds transparency
+        max_workers : int
+            Number of thumbnails requested and downloaded concurrently
+        """
 
-            array = array.reshape((1,) + array.shape)
+        thumbnails = self._fetch_thumbnails(scale, dimensions, max_workers)
 
-            # Add alpha channel if needed
-            if alpha_channel and array.shape[3] == 3:
-                array = np.append(
-                    array, np.full((array.shape[0], array.shape[1], array.shape[2], 1), 255), axis=3
+        # Decode each thumbnail straight into a preallocated (T, H, W, C) array
+        channels = 4 if alpha_channel else 3
+        composites = None
+        for n, array in enumerate(thumbnails):
+            if composites is None:
+                composites = np.empty(
+                    (len(self.dates),) + array.shape[:2] + (channels,), dtype=np.uint8
                 )
-                if n == 0:
-                    composites = array[:, :, :, :4]
-                else:
-                    composites = np.append(composites, array[:, :, :, :4], axis=0)
-            else:
-                if n == 0:
-                    composites = array[:, :, :, :3]
-                else:
-                    composites = np.append(composites, array[:, :, :, :3], axis=0)
+            self._fill_frame(composites[n], array, alpha_channel)
 
         return composites
 
     def _add_text(self, img, text, y_pixels=40, y_offset=40):
-        np_img = np.array(img)
-        img = Image.fromarray(np_img.astype(np.uint8))
+        """Blend white text into the img array in place"""
+        mask = render_text_mask(str(text), y_pixels + 10)
+        x_offset = int(y_pixels / 5)
+
+        # Clip the label to the frame
+        height = min(mask.shape[0], img.shape[0] - y_offset)
+        width = min(mask.shape[1], img.shape[1] - x_offset)
+        if height <= 0 or width <= 0:
+            return img
 
-        draw = ImageDraw.Draw(img)
-        font = ImageFont.truetype("../data/raw/Roboto-Regular.ttf", y_pixels + 10)
-        draw.text((int(y_pixels / 5), y_offset), str(text), (255, 255, 255), font=font)
+        region = img[y_offset : y_offset + height, x_offset : x_offset + width]
+        alpha = mask[:height, :width, np.newaxis].astype(np.uint16)
+        region[...] = region + ((255 - region.astype(np.uint16)) * alpha + 127) // 255
 
-        return np.array(img)
+        return img
 
     def add_text(self, composites):
         for n, image in enumerate(composites):
-            img = Image.fromarray(image.astype(np.uint8))
             # Add instrument
             instrument = self.instruments[n]
             gee_data = GEEData(instrument)
-            img = self._add_text(img, text=gee_data.title, y_pixels=40, y_offset=10)
+            self._add_text(image, text=gee_data.title, y_pixels=40, y_offset=10)
 
             # Add date
             date = self.dates[n].replace("-", "/")
-            img = self._add_text(img, text=date, y_pixels=40, y_offset=80)
-
-            composites[n, :] = np.array(img)
+            self._add_text(image, text=date, y_pixels=40, y_offset=80)
 
         return composites
 
@@ -259,7 +568,27 @@ class GEEExtractor:
         plt.show()
 
     @staticmethod
-    def save_frames_as_pngs(video, folder_path, region_name):
+    def save_frames_as_pngs(
+        video,
+        folder_path,
+        region_name,
+        max_workers=None,
+        compress_level=6,
+        optimize=False,
+        archive=False,
+    ):
+        """
+        Save each frame as a PNG image, encoding them in parallel.
+        ----------
+        max_workers : int
+            Number of processes encoding frames. Defaults to the number of CPUs
+        compress_level : int
+            zlib compression level from 0 (none) to 9 (smallest)
+        optimize : Boolean
+            If True PIL looks for the smallest encoding, which is slower
+        archive : Boolean
+            If True the PNGs are written into a single region_name.zip file instead
+        """
         region_dir = os.path.join(folder_path, region_name)
 
         # Check if the folder exists
@@ -270,61 +599,42 @@ class GEEExtractor:
         else:
             print(f"Folder '{region_dir}' already exists.")
 
-        # Iterate through the frames and save each as a PNG image
-        for frame_index in range(video.shape[0]):
-            # Extract the frame as a 3D array (height x width x channels)
-            frame = video[frame_index, :, :, :]
-
-            # Create a PIL Image from the frame
-            image = Image.fromarray(frame)
-
-            # Define the file name for the PNG image (e.g., "frame_0.png", "frame_1.png", etc.)
-            file_name = f"frame_{frame_index}.png"
-
-            # Save the image as a PNG
-            image.save(os.path.join(region_dir, region_name + f"_{frame_index:03d}.png"))
-
-            print(f"Saved {file_name}")
+        # Define the file name for each PNG image (e.g., "region_000.png", "region_001.png", etc.)
+        file_names = [region_name + f"_{frame_index:03d}.png" for frame_index in range(len(video))]
+
+        # Encode the frames (height x width x channels) in parallel
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pngs = executor.map(
+                encode_png, video, repeat(compress_level), repeat(optimize), chunksize=4
+            )
+
+            if archive:
+                # PNGs are already compressed, so they are stored as they are
+                archive_path = os.path.join(region_dir, f"{region_name}.zip")
+                with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED) as zf:
+                    for file_name, png in zip(file_names, pngs):
+                        zf.writestr(file_name, png)
+            else:
+                for file_name, png in zip(file_names, pngs):
+                    with open(os.path.join(region_dir, file_name), "wb") as f:
+                        f.write(png)
 
-        print("All frames saved as PNG images.")
+        print(f"All {len(file_names)} frames saved as PNG images.")
 
     @staticmethod
-    def create_animation(folder_path, region_name, output_format="mp4"):
+    def create_animation(folder_path, region_name, output_format="mp4", video=None):
+        """
+        Encode the frames of a region as an mp4, webm, gif or apng video.
+        ----------
+        video : np.ndarray
+            (T, H, W, C) frames to encode. If None, the PNGs saved with save_frames_as_pngs
+            are used.
+        """
         region_dir = os.path.join(folder_path, region_name)
+        os.makedirs(region_dir, exist_ok=True)
 
-        if output_format == "mp4":
-            cmd = f"ffmpeg -framerate 1 -i {region_dir}/{region_name}_%03d.png -c:v libx264 -crf 0 -y {region_dir}/{region_name}.mp4"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
-        if output_format == "apng":
-            cmd = f"ffmpeg -framerate 3 -i {region_dir}/{region_name}_%03d.png -plays 0 -y {region_dir}/{region_name}.apng"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
-        if output_format == "gif":
-            cmd = f"ffmpeg -framerate 1 -i {region_dir}/{region_name}_%03d.png -y {region_dir}/{region_name}.gif"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
-        if output_format == "webm":
-            cmd = f"ffmpeg -framerate 1 -f image2 -i {region_dir}/{region_name}_%03d.png -c:v libvpx-vp9 -pix_fmt yuva420p -y {region_dir}/{region_name}.webm"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
+        if video is None:
+            file_names = sorted(glob.glob(f"{region_dir}/{region_name}_[0-9][0-9][0-9].png"))
+            video = (np.array(Image.open(file_name)) for file_name in file_names)
+
+        return encode_video(video, f"{region_dir}/{region_name}.{output_format}", output_format)
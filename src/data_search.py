@@ -1,13 +1,88 @@
+import datetime as dt
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
 import requests
 
 import matplotlib.pyplot as plt
-from skimage import io
 import ee
-import urllib.request
-from PIL import Image
-import numpy as np
 
 from data_params import GEEData
+from thumbnail_fetcher import thumbnail_fetcher
+
+
+class SearchCache:
+    """
+    On-disk cache of STAC search results stored in SQLite.
+    ----------
+    path : str
+        SQLite file where the results are stored
+    ttl : float
+        Seconds after which a cached search is fetched again
+    max_entries : int
+        Maximum number of searches kept, the least recently used are evicted first
+    """
+
+    def __init__(self, path='~/.cache/hls_data_project/stac_search.sqlite', ttl=24 * 3600,
+                 max_entries=1000):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS searches '
+                         '(key TEXT PRIMARY KEY, created REAL, accessed REAL, features BLOB)')
+
+    def _connect(self):
+        # SQLite locking makes the cache safe to share between processes
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    @staticmethod
+    def _key(params):
+        return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+    def get(self, params):
+        """Cached features of a search, or None if missing or expired"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT created, features FROM searches WHERE key = ?',
+                               (self._key(params),)).fetchone()
+            if row is None or now - row[0] > self.ttl:
+                self.misses += 1
+                return None
+            conn.execute('UPDATE searches SET accessed = ? WHERE key = ?', (now, self._key(params)))
+        self.hits += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def set(self, params, features):
+        """Store the features of a search, evicting expired and least recently used ones"""
+        now = time.time()
+        blob = zlib.compress(json.dumps(features, separators=(',', ':')).encode())
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)',
+                         (self._key(params), now, now, blob))
+            conn.execute('DELETE FROM searches WHERE created < ?', (now - self.ttl,))
+            conn.execute('DELETE FROM searches WHERE key NOT IN '
+                         '(SELECT key FROM searches ORDER BY accessed DESC LIMIT ?)',
+                         (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM searches')
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
 
 
 class CMRSTACCatalog:
@@ -17,8 +92,13 @@ class CMRSTACCatalog:
     collections = ["HLSS30.v2.0", "HLSL30.v2.0"]
     search_endpoint = f"{stac_endpoint}/{catalog}/search"
     
-    def __init__(self):
+    def __init__(self, cache=None):
+        """
+        cache : SearchCache
+            Optional on-disk cache of the search results
+        """
         self.session = requests.Session()
+        self.cache = cache
 
     def create_search_params(self, bbox, start_date=None, end_date=None, 
                              datetime=None, limit=12):
@@ -34,12 +114,119 @@ class CMRSTACCatalog:
     
     def search(self, bbox, start_date=None, end_date=None, datetime=None, limit=12):
         params = self.create_search_params(bbox, start_date, end_date, datetime, limit)
+        if self.cache is not None:
+            features = self.cache.get(params)
+            if features is not None:
+                return features
+
         response = self.session.post(self.search_endpoint, json=params)
         if response.status_code == 200:
-            return response.json()['features']
+            features = response.json()['features']
+            if self.cache is not None:
+                self.cache.set(params, features)
+            return features
         else:
             response.raise_for_status()
 
+    @staticmethod
+    def _split_datetime(datetime, intervals):
+        """Split a 'start/end' datetime range into intervals sub-ranges"""
+        if intervals <= 1:
+            return [datetime]
+        bounds = datetime.split('/')
+        if len(bounds) != 2 or '..' in bounds or '' in bounds:
+            raise ValueError(f"Cannot split datetime '{datetime}' into {intervals} intervals, "
+                             "it needs a closed 'start/end' range")
+        start, end = [dt.datetime.fromisoformat(d.replace('Z', '+00:00')) for d in bounds]
+        step = (end - start) / intervals
+        bounds = [start + step * i for i in range(intervals)] + [end]
+        return [f"{a:%Y-%m-%dT%H:%M:%SZ}/{b:%Y-%m-%dT%H:%M:%SZ}"
+                for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def _search_pages(self, params):
+        """Generator of the features of each page, following the STAC next links"""
+        request = {'method': 'POST', 'href': self.search_endpoint, 'body': params}
+        while request is not None:
+            if request.get('method', 'GET') == 'POST':
+                body = request.get('body', params)
+                if request.get('merge', False):
+                    body = {**params, **body}
+                response = self.session.post(request['href'], json=body)
+            else:
+                response = self.session.get(request['href'])
+            response.raise_for_status()
+
+            page = response.json()
+            yield page['features']
+            request = next(
+                (link for link in page.get('links', []) if link.get('rel') == 'next'), None)
+
+    def iter_search(self, bbox, start_date=None, end_date=None, datetime=None, limit=100,
+                    intervals=1, max_workers=4):
+        """
+        Generator of all the features of a search, streamed as pages arrive.
+        With a cache, the features of each completed sub-range are stored and later
+        searches of the same sub-range are answered without requests.
+        ----------
+        limit : int
+            Number of features per page
+        intervals : int
+            Number of sub-ranges the datetime range is split into, queried concurrently
+        max_workers : int
+            Maximum number of sub-ranges queried at the same time
+        """
+        params = self.create_search_params(bbox, start_date, end_date, datetime, limit)
+        datetimes = self._split_datetime(params['datetime'], intervals)
+
+        pages = queue.Queue()
+        stop = threading.Event()
+
+        def fetch(datetime):
+            sub_params = {**params, 'datetime': datetime}
+            # all the pages, unlike search which caches the first one
+            cache_params = {**sub_params, 'paginated': True}
+            try:
+                if self.cache is not None:
+                    cached = self.cache.get(cache_params)
+                    if cached is not None:
+                        pages.put(cached)
+                        return
+
+                sub_range_features = []
+                for features in self._search_pages(sub_params):
+                    pages.put(features)
+                    sub_range_features.extend(features)
+                    if stop.is_set():
+                        # incomplete, so not cached
+                        return
+
+                if self.cache is not None:
+                    self.cache.set(cache_params, sub_range_features)
+            finally:
+                pages.put(None)
+
+        seen = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch, datetime) for datetime in datetimes]
+            try:
+                done = 0
+                while done < len(futures):
+                    features = pages.get()
+                    if features is None:
+                        done += 1
+                        continue
+                    # sub-ranges share their bounds, so items may come twice
+                    for feature in features:
+                        if feature['id'] not in seen:
+                            seen.add(feature['id'])
+                            yield feature
+            finally:
+                stop.set()
+
+        # raise any request error
+        for future in futures:
+            future.result()
+
     @staticmethod
     def display_rgb_images(items):
         num_items = len(items)
@@ -51,9 +238,11 @@ class CMRSTACCatalog:
         if num_items == 1:
             ax = [[ax]]  # Wrap the single axis in a 2D array
 
-        for i, item in enumerate(items):
-            image_url = item['assets']['browse']['href']
-            image = io.imread(image_url)
+        # Download all the browse images at once
+        image_urls = [item['assets']['browse']['href'] for item in items]
+        images = thumbnail_fetcher.fetch_many(image_urls)
+
+        for i, (item, image) in enumerate(zip(items, images)):
             datetime = item['properties']['datetime']
 
             ax[i].imshow(image)
@@ -84,47 +273,39 @@ class GEECatalog:
         date_format = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd')
         return image.set('date', date_format)
     
+    def _search_instrument(self, instrument, start_date, end_date):
+        """Same-day mosaics of an instrument, with a single round trip to fetch the dates"""
+        gee_data = GEEData(instrument)
+
+        # Get collection
+        collection = ee.ImageCollection(gee_data.collection_id)\
+        .filterDate(start_date, end_date)\
+        .filterBounds(self.roi)
+
+        # Map the function over the collection
+        collection = collection.map(self._add_date)
+
+        # Group the images by date and mosaic them on the server
+        dates = collection.aggregate_array('date').distinct().sort()
+        mosaics = dates.map(
+            lambda date: collection.filter(ee.Filter.eq('date', date)).mosaic().set('date', date))
+
+        date_images = {}
+        for i, date in enumerate(dates.getInfo()):
+            date_images[date] = ee.Image(mosaics.get(i))
+
+        return date_images
+
     def search_images(self, geometry, start_date, end_date):
         # Define the region of interest (ROI) as a polygon
         self.roi = ee.Geometry.Polygon(geometry['features'][0]['geometry']['coordinates'])
 
-        # Get images
-        images = {}
-        for instrument in self.instruments:
-            gee_data = GEEData(instrument)
-            
-            # Get collection
-            collection = ee.ImageCollection(gee_data.collection_id)\
-            .filterDate(start_date, end_date)\
-            .filterBounds(self.roi)
-
-            # Map the function over the collection
-            collection = collection.map(self._add_date)
-
-            # Get the list of images
-            image_list = collection.toList(collection.size())
-
-            date_images = {}
-            pre_date = ''
-            for i in range(collection.size().getInfo()):
-                image = ee.Image(image_list.get(i))
-                date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
-                if date == pre_date:
-                    images_list.append(image)
-                    # Create an image collection from the list of images
-                    image_collection = ee.ImageCollection.fromImages(images_list)
-                    # Create a composite image from the image collection using mosaic
-                    composite_image = image_collection.mosaic()
-                    # Add composite image to dict
-                    date_images[date] = composite_image
-                else: 
-                    # Add image to dict
-                    date_images[date] = image
-
-                    images_list = [image]
-                    pre_date = date
-
-            images[instrument] = date_images
+        # Get images, querying the instruments concurrently
+        with ThreadPoolExecutor(max_workers=len(self.instruments)) as executor:
+            results = executor.map(
+                lambda instrument: self._search_instrument(instrument, start_date, end_date),
+                self.instruments)
+            images = dict(zip(self.instruments, results))
 
         # Reorder images 
         images_dict = {}
@@ -151,21 +332,23 @@ class GEECatalog:
         fig, ax = plt.subplots(num_rows, num_cols, figsize=(num_cols * 4, num_rows * 4))
         ax = ax.ravel()  # Flatten the 2D array of axes
 
-        for i, (date, image_dict) in enumerate(images_dict.items()):
+        def thumbnail_url(image_dict):
             instrument, image = list(image_dict.items())[0]
             gee_data = GEEData(instrument)
 
             # Get the thumbnail URL
-            thumbnail_url = image.visualize(**gee_data.swir_vis).getThumbURL({
+            return image.visualize(**gee_data.swir_vis).getThumbURL({
                 'dimensions': 500, 
                 'format': 'png',
                 'crs': 'EPSG:3857', 
                 'region':self.roi     
             })
 
-            # Open the URL and read the image using PIL
-            with urllib.request.urlopen(thumbnail_url) as response:
-                thumbnail =  np.array(Image.open(response))
+        # Get the thumbnail URLs and download the thumbnails all at once
+        thumbnails = thumbnail_fetcher.fetch_many(images_dict.values(), get_url=thumbnail_url)
+
+        for i, ((date, image_dict), thumbnail) in enumerate(zip(images_dict.items(), thumbnails)):
+            instrument = list(image_dict)[0]
 
             # display image
             ax[i].imshow(thumbnail)
@@ -1,6 +1,9 @@
+import copy
+import glob
 import os
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
+import psutil
 import torch
 import numpy as np
 from PIL import Image
@@ -10,20 +13,79 @@ from mmcv.parallel import collate, scatter
 from mmseg.apis import init_segmentor
 from mmseg.datasets.pipelines import Compose
 
+from video_encoder import encode_video
+
+
+def adapt_test_pipeline(test_pipeline, bands=None):
+    """
+    Copy of a test pipeline collecting the image metas inference needs, and extracting
+    bands if given. The array configs collect no metas at all.
+    ----------
+    test_pipeline : list of dict
+        Test pipeline of the model config, left untouched
+    bands : str
+        List of bands to extract, e.g. "[0, 1, 2, 3, 4, 5]"
+    """
+    test_pipeline = copy.deepcopy(test_pipeline)
+
+    if bands is not None:
+        extract_index = [
+            i
+            for i, x in enumerate(test_pipeline)
+            if x["type"] in ("BandsExtract", "TorchFusedPreprocess")
+        ]
+
+        if len(extract_index) > 0:
+            test_pipeline[extract_index[0]]["bands"] = eval(bands)
+
+    collect_index = [
+        i for i, x in enumerate(test_pipeline) if x["type"].find("Collect") > -1
+    ]
+    if len(collect_index) > 0:
+        keys = [
+            "img_info",
+            "img",
+            "img_shape",
+            "ori_shape",
+            "pad_shape",
+            "scale_factor",
+            "img_norm_cfg",
+        ]
+        test_pipeline[collect_index[0]]["meta_keys"] = keys
+
+    return test_pipeline
 
 
 class ModelProcessor:
-    def __init__(self, config_path, ckpt, bands=None):
+    """
+    ----------
+    memory_factor : float
+        Memory needed by a chip during inference, as a multiple of its float32 input size.
+        Used to size the batches of predict_batch, see _default_memory_factor
+    """
+
+    def __init__(self, config_path, ckpt, bands=None, quantize=None, calibration_arrays=None,
+                 backend="pytorch", onnx_path=None, memory_factor=None):
         self.config_path = config_path
         self.ckpt = ckpt
         self.bands = bands
-        self._load_model()
-
-    def _load_model(self):
+        on_cpu = quantize or backend == "onnxruntime"
+        self._load_model(device="cpu" if on_cpu else "cuda:0")
+        self.memory_factor = memory_factor or self._default_memory_factor()
+        self.backend = "pytorch"
+        self.quantized = None
+        # device the model goes back to when switching from onnxruntime to pytorch
+        self._pytorch_device = None
+
+        if quantize:
+            self.quantize(quantize, calibration_arrays)
+        self.set_backend(backend, onnx_path)
+
+    def _load_model(self, device="cuda:0"):
         # Load model
         config = Config.fromfile(self.config_path)
         config.model.backbone.pretrained = None
-        self.model = init_segmentor(config, self.ckpt)
+        self.model = init_segmentor(config, self.ckpt, device=device)
 
         # Set model device
         self.device = next(self.model.parameters()).device
@@ -33,42 +95,12 @@ class ModelProcessor:
         self._modify_test_pipeline()
 
     def _modify_test_pipeline(self):
-        custom_test_pipeline = self.cfg.data.test.pipeline
-
-        if self.bands is not None:
-            extract_index = [
-                i for i, x in enumerate(custom_test_pipeline) if x["type"] == "BandsExtract"
-            ]
-
-
-            if len(extract_index) > 0:
-                custom_test_pipeline[extract_index[0]]["bands"] = eval(self.bands)
-
-            collect_index = [
-                i for i, x in enumerate(custom_test_pipeline) if x["type"].find("Collect") > -1
-            ]
-            if len(collect_index) > 0:
-                keys = [
-                    "img_info",
-                    "img",
-                    "img_shape",
-                    "ori_shape",
-                    "pad_shape",
-                    "scale_factor",
-                    "img_norm_cfg",
-                ]
-                custom_test_pipeline[collect_index[0]]["meta_keys"] = keys
-
-            # build the data pipeline
-            self.test_pipeline = Compose(custom_test_pipeline)
+        # build the data pipeline
+        self.test_pipeline = Compose(adapt_test_pipeline(self.cfg.data.test.pipeline, self.bands))
 
-    def predict(self, array):
-        data = []
-        img_data = {"img_info": {"array": array}}
-        img_data = self.test_pipeline(img_data)
-        data.append(img_data)
-
-        data = collate(data, samples_per_gpu=1)
+    def _forward(self, data):
+        """Run the model on a list of test pipeline results, returning one mask per item"""
+        data = collate(data, samples_per_gpu=len(data))
         if next(self.model.parameters()).is_cuda:
             data = scatter(data, [self.device])[0]
         else:
@@ -76,12 +108,195 @@ class ModelProcessor:
             img = data["img"]
             data = {"img": img, "img_metas": img_metas}
 
+        # a single list of metas for the whole batch
+        data["img_metas"] = [[meta for metas in data["img_metas"] for meta in metas]]
+
         with torch.no_grad():
-            result = self.model(return_loss=False, rescale=True, **data)
+            return self.model(return_loss=False, rescale=True, **data)
+
+    def _default_memory_factor(self):
+        """
+        The peak memory of a chip is dominated by the neck, which upsamples the tokens back
+        to the input resolution with as many channels as the decode head takes, and keeps
+        an intermediate of the same size. That is twice the head channels per input band
+        and frame: 2 * 768 / 6 = 256 for the burn scars model.
+        """
+        in_chans = self.model.backbone.patch_embed.proj.in_channels
+        num_frames = self.model.backbone.num_frames
+        return 2 * self.model.decode_head.in_channels / (in_chans * num_frames)
+
+    def _auto_batch_size(self, array):
+        """Number of chips like array that fit in half of the available memory"""
+        if next(self.model.parameters()).is_cuda:
+            available, _ = torch.cuda.mem_get_info(self.device)
+        else:
+            available = psutil.virtual_memory().available
+        per_chip = array.size * 4 * self.memory_factor
+        return max(1, int(available // 2 // per_chip))
+
+    def predict(self, array):
+        data = []
+        img_data = {"img_info": {"array": array}}
+        img_data = self.test_pipeline(img_data)
+        data.append(img_data)
+
+        result = self._forward(data)
 
         self.mask = result[0]
         return self.mask
-    
+
+    def predict_batch(self, arrays, batch_size=None, max_workers=4):
+        """
+        Predict several chips of the same shape, running them through the model in batches.
+        ----------
+        arrays : list of np.ndarray or np.ndarray
+            (H, W, C) chips, or a stacked (N, H, W, C) array
+        batch_size : int
+            Number of chips per forward pass. By default it adapts to the available memory
+        max_workers : int
+            Number of threads running the test pipeline
+        """
+        arrays = list(arrays)
+        if len(arrays) == 0:
+            self.masks = []
+            return self.masks
+        if batch_size is None:
+            batch_size = self._auto_batch_size(arrays[0])
+
+        # run the test pipeline on each chip
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            data = list(
+                executor.map(
+                    lambda array: self.test_pipeline({"img_info": {"array": array}}), arrays
+                )
+            )
+
+        self.masks = []
+        for i in range(0, len(data), batch_size):
+            self.masks.extend(self._forward(data[i : i + batch_size]))
+
+        return self.masks
+
+    def set_backend(self, backend="pytorch", onnx_path=None):
+        """
+        Choose what runs the sliding windows of the model, the slide orchestration stays in
+        PyTorch.
+        ----------
+        backend : str
+            'pytorch' or 'onnxruntime' (CPU). onnxruntime can't be used with a quantized model
+        onnx_path : str
+            Graph written by export_onnx. If the file doesn't exist it is exported there.
+            The model moves to CPU, and back to its device when switching to pytorch again
+        """
+        assert backend in ("pytorch", "onnxruntime"), f"Unknown backend {backend}"
+        if backend == "pytorch":
+            self.backend = backend
+            self.model.window_backend = None
+            if self._pytorch_device is not None:
+                self.model = self.model.to(self._pytorch_device)
+                self.device = next(self.model.parameters()).device
+                self._pytorch_device = None
+            return
+
+        assert onnx_path is not None, "The onnxruntime backend needs onnx_path"
+        assert self.quantized is None, \
+            "The onnxruntime backend can't be used with a quantized model"
+        # Only needed by this backend, the geospatial_fm package may not be installed
+        from geospatial_fm import ONNXRuntimeBackend, export_onnx
+
+        if self.backend == "pytorch":
+            self._pytorch_device = self.device
+        self.backend = backend
+        self.model = self.model.cpu()
+        self.device = next(self.model.parameters()).device
+        if not os.path.isfile(onnx_path):
+            export_onnx(self.model, onnx_path)
+        self.model.window_backend = ONNXRuntimeBackend(onnx_path)
+
+    def compare_backends(self, array, onnx_path):
+        """
+        Predict a chip with PyTorch and with ONNX Runtime, returning the fraction of pixels
+        where both masks agree. The logits are already checked within tolerance by export_onnx.
+        ----------
+        array : np.ndarray
+            (H, W, C) chip
+        onnx_path : str
+            Graph written by export_onnx. If the file doesn't exist it is exported there
+        """
+        if not os.path.isfile(onnx_path):
+            from geospatial_fm import export_onnx
+
+            # export from a CPU copy, the model keeps running on its device
+            export_onnx(copy.deepcopy(self.model).cpu(), onnx_path)
+
+        backend = self.backend
+        data = [self.test_pipeline({"img_info": {"array": array}})]
+
+        self.set_backend("pytorch")
+        torch_mask = self._forward(data)[0]
+        self.set_backend("onnxruntime", onnx_path)
+        onnx_mask = self._forward(data)[0]
+        self.set_backend(backend, onnx_path)
+
+        agreement = float((torch_mask == onnx_mask).mean())
+        print(f"PyTorch and ONNX Runtime masks agree on {agreement:.2%} of pixels")
+        return agreement
+
+    def quantize(self, mode="dynamic", calibration_arrays=None):
+        """
+        Quantize the model to INT8 for CPU inference.
+        ----------
+        mode : str
+            'dynamic' quantizes the Linear layers of the ViT blocks. 'static' also quantizes
+            the convolutions of the neck and decode head, calibrated on calibration_arrays
+        calibration_arrays : list of np.ndarray
+            (H, W, C) chips used to calibrate the static quantization
+        """
+        assert mode in ("dynamic", "static"), f"Unknown quantization mode {mode}"
+        assert mode == "dynamic" or calibration_arrays is not None, \
+            "Static quantization needs calibration_arrays"
+        assert self.backend == "pytorch", "Only the pytorch backend can be quantized"
+        from geospatial_fm import quantize_segmentor
+
+        # quantized kernels only run on CPU
+        self.model = quantize_segmentor(
+            self.model.cpu(),
+            static_convs=mode == "static",
+            calibrate=lambda: self.predict_batch(calibration_arrays),
+        )
+        self.device = next(self.model.parameters()).device
+        self.quantized = mode
+        return self.model
+
+    def quantization_report(self, arrays, gt_masks=None, mode="dynamic", calibration_arrays=None):
+        """
+        Quantize the model and report the mIoU drift and speed-up against fp32.
+        ----------
+        arrays : list of np.ndarray
+            Held-out (H, W, C) chips
+        gt_masks : list of np.ndarray
+            Ground truth masks of the chips. Without them the quantized predictions are
+            compared against the fp32 ones
+        mode : str
+            Quantization mode, see quantize
+        calibration_arrays : list of np.ndarray
+            Chips used to calibrate the static quantization
+        """
+        from geospatial_fm import quantization_report
+
+        # compare against fp32 on the same device the quantized model runs on
+        self.model = self.model.cpu()
+        self.device = next(self.model.parameters()).device
+
+        return quantization_report(
+            lambda chips: self.predict_batch(chips),
+            lambda: self.quantize(mode, calibration_arrays),
+            list(arrays),
+            gt_masks,
+            num_classes=self.model.decode_head.num_classes,
+            ignore_index=self.cfg.get("ignore_index", -1),
+        )
+
     @staticmethod
     def display_io(array, mask):
         rgb_image = np.stack((array[:, :, 5], array[:, :, 3], array[:, :, 2]), axis=-1)
@@ -97,18 +312,8 @@ class ModelProcessor:
         ax[1].axis('off')
 
     @staticmethod
-    def save_io_as_png(array, mask, folder_path, region_name):
-        region_dir = os.path.join(folder_path, region_name)
-
-        # Check if the folder exists
-        if not os.path.exists(region_dir):
-            # If the folder doesn't exist, create it
-            os.makedirs(region_dir)
-            print(f"Folder '{region_dir}' created.")
-        else:
-            print(f"Folder '{region_dir}' already exists.")
-
-        # Save composite
+    def io_frames(array, mask):
+        """Input color composite and prediction overlay as uint8 RGB frames"""
         # Select bands
         rgb_image = array[..., [5, 3, 2]]
 
@@ -119,13 +324,6 @@ class ModelProcessor:
         # Scale the values to the range [0, 255]
         rgb_image = (rgb_image * 255).astype(np.uint8)
 
-        # Convert the NumPy array to a PIL Image
-        image = Image.fromarray(rgb_image)
-
-        # Save the image as a PNG file 
-        image.save(os.path.join(region_dir, f"{region_name}_001.png"))
-
-        # Save mask
         # Create a copy of the RGB array to preserve the original data
         rgb_mask = np.copy(rgb_image)
 
@@ -136,6 +334,30 @@ class ModelProcessor:
         # Make the mask oixels white
         rgb_mask[mask_array == 1] = 255
 
+        return rgb_image, rgb_mask
+
+    @staticmethod
+    def save_io_as_png(array, mask, folder_path, region_name):
+        region_dir = os.path.join(folder_path, region_name)
+
+        # Check if the folder exists
+        if not os.path.exists(region_dir):
+            # If the folder doesn't exist, create it
+            os.makedirs(region_dir)
+            print(f"Folder '{region_dir}' created.")
+        else:
+            print(f"Folder '{region_dir}' already exists.")
+
+        rgb_image, rgb_mask = ModelProcessor.io_frames(array, mask)
+
+        # Save composite
+        # Convert the NumPy array to a PIL Image
+        image = Image.fromarray(rgb_image)
+
+        # Save the image as a PNG file 
+        image.save(os.path.join(region_dir, f"{region_name}_001.png"))
+
+        # Save mask
         # Convert the NumPy array to a PIL Image for saving
         image = Image.fromarray(rgb_mask)
 
@@ -144,48 +366,22 @@ class ModelProcessor:
 
 
     @staticmethod
-    def create_animation(folder_path, region_name, output_format = 'mp4'):
+    def create_animation(folder_path, region_name, output_format = 'mp4', array=None, mask=None):
+        """
+        Encode the input composite and the prediction as an mp4, webm, gif or apng video.
+        If array and mask are given the frames are piped to ffmpeg in memory, otherwise
+        the PNGs saved with save_io_as_png are used.
+        """
         region_dir = os.path.join(folder_path, region_name)
+        os.makedirs(region_dir, exist_ok=True)
 
-        if output_format == 'mp4':
-            cmd = f"ffmpeg -framerate 1 -stream_loop 5 -i {region_dir}/{region_name}_%03d.png -c:v libx264 -crf 0 -y {region_dir}/{region_name}.mp4"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
-        if output_format == 'apng':
-            cmd = f"ffmpeg -framerate 3 -i {region_dir}/{region_name}_%03d.png -plays 0 -y {region_dir}/{region_name}.apng"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
-        if output_format == 'gif':
-            cmd = f"ffmpeg -framerate 1 -i {region_dir}/{region_name}_%03d.png -y {region_dir}/{region_name}.gif"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
-        if output_format == 'webm':
-            cmd = f"ffmpeg -framerate 1 -f image2 -i {region_dir}/{region_name}_%03d.png -c:v libvpx-vp9 -pix_fmt yuva420p -y {region_dir}/{region_name}.webm"
-            print(f"Processing: {cmd}")
-            r = subprocess.call(cmd, shell=True)
-            if r == 0:
-                print("Task created")
-            else:
-                print("Task failed")
-            print("Finished processing")
-
-
-
-        
-            
+        if array is not None and mask is not None:
+            frames = ModelProcessor.io_frames(array, mask)
+        else:
+            file_names = sorted(glob.glob(f"{region_dir}/{region_name}_[0-9][0-9][0-9].png"))
+            frames = [np.array(Image.open(file_name)) for file_name in file_names]
 
+        # mp4 plays the pair of frames 6 times
+        repeat = 6 if output_format == 'mp4' else 1
+        return encode_video(frames, f"{region_dir}/{region_name}.{output_format}", output_format,
+                            repeat=repeat)
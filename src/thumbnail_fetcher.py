@@ -0,0 +1,97 @@
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ThumbnailFetcher:
+    """
+    Concurrent image downloader with a pooled HTTP session, retries and an in-memory cache.
+    ----------
+    max_workers : int
+        Number of images downloaded at the same time
+    retries : int
+        Number of retries of failed requests
+    backoff_factor : float
+        Factor of the exponential wait between retries
+    cache_size : int
+        Maximum number of decoded images kept in memory
+    timeout : float
+        Seconds to wait for the server
+    """
+
+    def __init__(self, max_workers=8, retries=3, backoff_factor=0.5, cache_size=128, timeout=60):
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self.timeout = timeout
+
+        self._retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+        )
+        self.session = requests.Session()
+        self._pool_size = 0
+        self._mount(max_workers)
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _mount(self, pool_size):
+        """Keep up to pool_size connections per host, one for each concurrent download"""
+        if pool_size <= self._pool_size:
+            return
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=self._retry
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool_size = pool_size
+
+    def fetch(self, url):
+        """Download and decode an image, read-only as it is shared through the cache"""
+        with self._lock:
+            if url in self._cache:
+                self._cache.move_to_end(url)
+                return self._cache[url]
+
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        array = np.array(Image.open(io.BytesIO(response.content)))
+        array.flags.writeable = False
+
+        with self._lock:
+            self._cache[url] = array
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return array
+
+    def fetch_many(self, urls, max_workers=None, get_url=None):
+        """
+        Download and decode images concurrently, yielding them in the order of urls.
+        ----------
+        max_workers : int
+            Number of images downloaded at the same time, defaults to the one of the fetcher
+        get_url : callable
+            Turns each item of urls into its url on the download threads, so slow calls
+            such as Earth Engine getThumbURL run concurrently too
+        """
+        max_workers = max_workers or self.max_workers
+        with self._lock:
+            self._mount(max_workers)
+
+        fetch = self.fetch if get_url is None else lambda item: self.fetch(get_url(item))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            yield from executor.map(fetch, urls)
+
+
+# Shared by the catalogs and extractors
+thumbnail_fetcher = ThumbnailFetcher()
@@ -0,0 +1,91 @@
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# ffmpeg framerate and output arguments of each format
+FORMATS = {
+    "mp4": {"framerate": 1, "args": ["-c:v", "libx264", "-crf", "0"]},
+    "apng": {"framerate": 3, "args": ["-plays", "0", "-f", "apng"]},
+    "gif": {"framerate": 1, "args": []},
+    "webm": {"framerate": 1, "args": ["-c:v", "libvpx-vp9", "-pix_fmt", "yuva420p"]},
+}
+
+
+def encode_video(frames, output_path, output_format="mp4", framerate=None, repeat=1):
+    """
+    Encode RGB(A) frames piping them straight into ffmpeg, with no intermediate files.
+    ----------
+    frames : np.ndarray or iterable of np.ndarray
+        (T, H, W, C) uint8 array, or (H, W, C) uint8 frames of the same shape, C being 3 or 4
+    output_path : str
+        Path of the video to write
+    output_format : str
+        One of "mp4", "webm", "gif" or "apng"
+    framerate : int
+        Frames per second. Defaults to the one of the format
+    repeat : int
+        Number of times the frames are played
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown format {output_format}, use one of {list(FORMATS)}")
+    settings = FORMATS[output_format]
+    framerate = framerate or settings["framerate"]
+
+    frames = iter(frames)
+    first = np.asarray(next(frames))
+    height, width, channels = first.shape
+    pix_fmt = "rgba" if channels == 4 else "rgb24"
+
+    if repeat > 1:
+        # rawvideo from a pipe cannot be looped by ffmpeg, so frames are sent again
+        frames = list(itertools.chain([first], frames))
+        frames = itertools.chain.from_iterable(itertools.repeat(frames, repeat))
+    else:
+        frames = itertools.chain([first], frames)
+
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-f", "rawvideo",
+        "-pix_fmt", pix_fmt,
+        "-s", f"{width}x{height}",
+        "-framerate", str(framerate),
+        "-i", "-",
+        *settings["args"],
+        "-y", output_path,
+    ]
+    # fmt: on
+    print(f"Processing: {' '.join(cmd)}")
+
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    try:
+        for frame in frames:
+            process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()
+    r = process.wait()
+
+    if r == 0:
+        print("Task created")
+    else:
+        print("Task failed")
+    print("Finished processing")
+
+    return r
+
+
+def encode_videos(jobs, max_workers=4):
+    """
+    Encode several videos in parallel, each in its own ffmpeg process.
+    ----------
+    jobs : list of dict
+        Keyword arguments of encode_video for each video
+    max_workers : int
+        Number of videos encoded at the same time
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda job: encode_video(**job), jobs))
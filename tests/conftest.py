@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+# the modules in src import each other by name, geospatial_fm is normally pip installed
+for folder in ("src", "Prithvi"):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, folder))
+
+# UTM zone 10N, 30 m pixels
+HLS_CRS = "EPSG:32610"
+HLS_ORIGIN = (500000.0, 4200000.0)
+
+
+def hls_band_values(offset, height=512, width=512):
+    """Raw values of a test band, offset * 1000 plus a pattern below 1000"""
+    import numpy as np
+
+    rows, cols = np.mgrid[:height, :width]
+    return (offset * 1000 + (rows * 7 + cols * 3) % 997).astype("int16")
+
+
+@pytest.fixture
+def write_hls_band(tmp_path):
+    """Write a small tiled GeoTIFF with overviews, like an HLS band COG"""
+    rio = pytest.importorskip("rasterio")
+
+    def write(name, offset, size=512, blocksize=128):
+        path = str(tmp_path / f"{name}.tif")
+        profile = dict(
+            driver="GTiff",
+            width=size,
+            height=size,
+            count=1,
+            dtype="int16",
+            crs=HLS_CRS,
+            transform=rio.transform.from_origin(*HLS_ORIGIN, 30, 30),
+            nodata=-9999,
+            tiled=True,
+            blockxsize=blocksize,
+            blockysize=blocksize,
+        )
+        with rio.open(path, "w", **profile) as dst:
+            dst.write(hls_band_values(offset, size, size), 1)
+            dst.scales = (0.0001,)
+            dst.build_overviews([2, 4], rio.enums.Resampling.nearest)
+        return path
+
+    return write
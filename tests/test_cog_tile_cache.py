@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+
+rio = pytest.importorskip("rasterio")
+
+from rasterio.windows import Window  # noqa: E402
+
+from cog_tile_cache import COGTileCache  # noqa: E402
+
+
+def tiles_on_disk(cache):
+    return sum(size for _, size, _ in cache._tiles())
+
+
+def test_read_matches_rasterio(tmp_path, write_hls_band):
+    href = write_hls_band("B04", 4)
+    cache = COGTileCache(str(tmp_path / "cache"))
+    window = Window(100, 120, 200, 230)
+
+    data = cache.read(href, window, (1, 230, 200))
+
+    with rio.open(href) as src:
+        np.testing.assert_array_equal(data, src.read(window=window))
+
+
+def test_read_uses_the_overview_of_the_output_shape(tmp_path, write_hls_band):
+    href = write_hls_band("B04", 4)
+    cache = COGTileCache(str(tmp_path / "cache"))
+
+    data = cache.read(href, Window(100, 120, 200, 230), (1, 115, 100))
+
+    with rio.open(href, overview_level=0) as overview:
+        expected = overview.read(window=Window(50, 60, 100, 115))
+    np.testing.assert_array_equal(data, expected)
+
+
+def test_cached_reads_do_not_open_the_cog(tmp_path, write_hls_band):
+    href = write_hls_band("B04", 4)
+    cache = COGTileCache(str(tmp_path / "cache"))
+    window = Window(100, 120, 200, 230)
+
+    first = cache.read(href, window, (1, 230, 200))
+    # rows 120-350 and columns 100-300 of 128 pixel tiles
+    assert cache.stats == {"hits": 0, "misses": 9}
+
+    # header and tiles come from the cache, the COG is not needed anymore
+    os.remove(href)
+    second = cache.read(href, window, (1, 230, 200))
+
+    assert cache.stats == {"hits": 9, "misses": 9}
+    np.testing.assert_array_equal(first, second)
+
+
+def test_evicts_the_least_recently_used_tiles(tmp_path, write_hls_band):
+    href = write_hls_band("B04", 4)
+    tile_bytes = 128 * 128 * 2 + 128  # .npy header
+    cache = COGTileCache(str(tmp_path / "cache"), max_bytes=3 * tile_bytes)
+
+    cache.read(href, Window(0, 0, 128, 128), (1, 128, 128))
+    cache.read(href, Window(128, 128, 384, 128), (1, 128, 384))
+
+    assert tiles_on_disk(cache) <= cache.max_bytes
+    assert cache._size == tiles_on_disk(cache)
+    # the first tile was read first, so it was evicted
+    assert not os.path.exists(cache._tile_path(href, -1, 0, 0))
+    assert os.path.exists(cache._tile_path(href, -1, 1, 3))
+
+
+def test_tracks_its_size_across_instances(tmp_path, write_hls_band):
+    href = write_hls_band("B04", 4)
+    path = str(tmp_path / "cache")
+    COGTileCache(path).read(href, Window(0, 0, 256, 128), (1, 128, 256))
+
+    cache = COGTileCache(path)
+    cache.read(href, Window(256, 0, 128, 128), (1, 128, 128))
+
+    assert cache._size == tiles_on_disk(cache)
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+rio = pytest.importorskip("rasterio")
+pytest.importorskip("osgeo")
+pytest.importorskip("ee")
+pytest.importorskip("matplotlib")
+pytest.importorskip("ipywidgets")
+
+import pyproj  # noqa: E402
+import shapely  # noqa: E402
+
+from cog_tile_cache import COGTileCache  # noqa: E402
+from conftest import HLS_CRS, HLS_ORIGIN, hls_band_values  # noqa: E402
+from data_extraction import COGExtractor  # noqa: E402
+
+# Landsat bands in the order of get_data, each written with its own value offset
+BANDS = {"B07": "swir_2", "B06": "swir_1", "B05": "nir", "B04": "red", "B03": "green",
+         "B02": "blue"}
+
+
+@pytest.fixture
+def item(write_hls_band):
+    assets = {band: {"href": write_hls_band(band, i + 1)} for i, band in enumerate(BANDS)}
+    return {"collection": "HLSL30.v2.0", "assets": assets}
+
+
+def polygon_of_pixels(col_start, row_start, col_stop, row_stop):
+    """WGS84 polygon of a block of pixels of the test bands"""
+    x0, y0 = HLS_ORIGIN
+    utm = shapely.box(x0 + 30 * col_start, y0 - 30 * row_stop, x0 + 30 * col_stop,
+                      y0 - 30 * row_start)
+    transformer = pyproj.Transformer.from_crs(HLS_CRS, "EPSG:4326", always_xy=True)
+    return shapely.transform(
+        utm, lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+    )
+
+
+@pytest.mark.parametrize("max_workers", [1, 6])
+def test_get_data_keeps_the_band_order(item, max_workers):
+    extractor = COGExtractor(item, polygon_of_pixels(100, 120, 300, 350))
+
+    band_data = extractor.get_data(max_workers=max_workers, dtype="int16")
+
+    assert list(band_data) == list(BANDS.values())
+    for i, name in enumerate(BANDS.values()):
+        inside = band_data[name][~extractor.band_masks[name]]
+        assert inside.size > 0
+        assert np.all(inside // 1000 == i + 1)
+        assert extractor.band_scales[name] == pytest.approx(0.0001)
+
+
+def test_get_data_reads_the_window_of_the_polygon(item):
+    extractor = COGExtractor(item, polygon_of_pixels(100, 120, 300, 350))
+
+    red = extractor.get_data(dtype="int16")["red"]
+
+    # the reprojected polygon may spill over one pixel on each side
+    height, width = red.shape
+    assert 230 <= height <= 232 and 200 <= width <= 202
+    expected = hls_band_values(4)
+    inside = ~extractor.band_masks["red"]
+    matches = [
+        np.array_equal(red[inside], expected[r : r + height, c : c + width][inside])
+        for r in (119, 120) for c in (99, 100)
+    ]
+    assert any(matches)
+
+
+def test_get_data_reads_coarser_resolutions_from_the_overviews(item):
+    extractor = COGExtractor(item, polygon_of_pixels(100, 120, 300, 350))
+
+    full = extractor.get_data(dtype="int16")["red"]
+    coarse = extractor.get_data(dtype="int16", resolution=60)["red"]
+
+    assert coarse.shape == tuple(round(n / 2) for n in full.shape)
+
+
+def test_get_data_through_the_tile_cache(item, tmp_path):
+    polygon = polygon_of_pixels(100, 120, 300, 350)
+    expected = COGExtractor(item, polygon).get_data(dtype="int16")
+    cache = COGTileCache(str(tmp_path / "cache"))
+
+    first = COGExtractor(item, polygon, tile_cache=cache).get_data(dtype="int16")
+    misses = cache.stats["misses"]
+    second = COGExtractor(item, polygon, tile_cache=cache).get_data(dtype="int16")
+
+    assert misses > 0 and cache.stats == {"hits": misses, "misses": misses}
+    for name in BANDS.values():
+        np.testing.assert_array_equal(first[name], expected[name])
+        np.testing.assert_array_equal(second[name], expected[name])
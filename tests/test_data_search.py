@@ -0,0 +1,178 @@
+import datetime as dt
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("matplotlib")
+pytest.importorskip("ee")
+
+import data_search  # noqa: E402
+from data_search import CMRSTACCatalog, SearchCache  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeSTACServer:
+    """Session answering STAC searches from a list of items, one page per request"""
+
+    def __init__(self, items):
+        self.items = items
+        self.requests = []
+
+    def _page(self, body, token):
+        start, end = [dt.datetime.fromisoformat(d.replace("Z", "+00:00"))
+                      for d in body["datetime"].split("/")]
+        matches = [item for item in self.items
+                   if start <= dt.datetime.fromisoformat(
+                       item["properties"]["datetime"].replace("Z", "+00:00")) <= end]
+        page = matches[token:token + body["limit"]]
+
+        links = []
+        if token + body["limit"] < len(matches):
+            links.append({"rel": "next", "method": "POST", "merge": True,
+                          "href": CMRSTACCatalog.search_endpoint,
+                          "body": {"token": token + body["limit"]}})
+        return FakeResponse({"features": page, "links": links})
+
+    def post(self, href, json):
+        self.requests.append(json)
+        return self._page(json, json.get("token", 0))
+
+    def get(self, href):
+        raise AssertionError("The fake server only answers POST requests")
+
+
+def make_items(n, start=dt.datetime(2023, 1, 1), step=dt.timedelta(days=1)):
+    return [{"id": f"item-{i}",
+             "properties": {"datetime": f"{start + step * i:%Y-%m-%dT%H:%M:%SZ}"}}
+            for i in range(n)]
+
+
+def make_catalog(items, cache=None):
+    catalog = CMRSTACCatalog(cache)
+    catalog.session = FakeSTACServer(items)
+    return catalog
+
+
+def test_iter_search_follows_next_links():
+    catalog = make_catalog(make_items(25))
+
+    features = list(catalog.iter_search([0, 0, 1, 1], "2023-01-01", "2023-01-31", limit=10))
+
+    assert [f["id"] for f in features] == [f"item-{i}" for i in range(25)]
+    # 3 pages of at most 10 items
+    assert len(catalog.session.requests) == 3
+
+
+def test_iter_search_splits_the_datetime_range():
+    catalog = make_catalog(make_items(30))
+
+    features = list(catalog.iter_search([0, 0, 1, 1], "2023-01-01", "2023-01-30", limit=10,
+                                        intervals=3))
+
+    # every item once, even those on the shared bounds of the sub-ranges
+    assert sorted(f["id"] for f in features) == sorted(f"item-{i}" for i in range(30))
+    assert len({r["datetime"] for r in catalog.session.requests}) == 3
+
+
+def test_iter_search_uses_the_cache(tmp_path):
+    catalog = make_catalog(make_items(25), SearchCache(str(tmp_path / "search.sqlite")))
+    args = ([0, 0, 1, 1], "2023-01-01", "2023-01-31")
+
+    first = list(catalog.iter_search(*args, limit=10, intervals=2))
+    num_requests = len(catalog.session.requests)
+    second = list(catalog.iter_search(*args, limit=10, intervals=2))
+
+    assert sorted(f["id"] for f in second) == sorted(f["id"] for f in first)
+    assert len(catalog.session.requests) == num_requests
+    assert catalog.cache.stats == {"hits": 2, "misses": 2}
+
+
+def test_split_datetime():
+    ranges = CMRSTACCatalog._split_datetime("2023-01-01T00:00:00Z/2023-01-03T00:00:00Z", 2)
+
+    assert ranges == ["2023-01-01T00:00:00Z/2023-01-02T00:00:00Z",
+                      "2023-01-02T00:00:00Z/2023-01-03T00:00:00Z"]
+
+
+@pytest.mark.parametrize("datetime", ["../2023-01-31T00:00:00Z", "2023-01-01T00:00:00Z/..",
+                                      "2023-01-01T00:00:00Z"])
+def test_split_datetime_rejects_open_ranges(datetime):
+    with pytest.raises(ValueError, match="closed 'start/end' range"):
+        CMRSTACCatalog._split_datetime(datetime, 2)
+
+    # nothing to split with a single interval
+    assert CMRSTACCatalog._split_datetime(datetime, 1) == [datetime]
+
+
+class FakeComputedObject:
+    """Lazy Earth Engine object, only getInfo makes a round trip"""
+
+    def __init__(self, fake_ee, value=None):
+        self._ee = fake_ee
+        self._value = value
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            # run mapped functions once, as the server would, to catch round trips in them
+            for arg in args:
+                if callable(arg):
+                    arg(FakeComputedObject(self._ee))
+            return FakeComputedObject(self._ee, self._value)
+
+        return method
+
+    def getInfo(self):  # noqa: N802
+        with self._ee.lock:
+            self._ee.round_trips += 1
+        return self._value
+
+
+class FakeEE:
+    """Stand-in for the ee module counting the round trips to the server"""
+
+    def __init__(self, dates):
+        self.dates = dates
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        self.Filter = FakeComputedObject(self)
+        self.Geometry = FakeComputedObject(self)
+
+    def Initialize(self):  # noqa: N802
+        pass
+
+    def ImageCollection(self, collection_id):  # noqa: N802
+        return FakeComputedObject(self, self.dates)
+
+    def Image(self, *args):  # noqa: N802
+        return FakeComputedObject(self)
+
+    def Date(self, *args):  # noqa: N802
+        return FakeComputedObject(self)
+
+
+@pytest.mark.parametrize("num_dates", [1, 10, 100])
+def test_gee_search_round_trips_do_not_grow_with_dates(monkeypatch, num_dates):
+    dates = [f"{dt.date(2023, 1, 1) + dt.timedelta(days=i):%Y-%m-%d}" for i in range(num_dates)]
+    fake_ee = FakeEE(dates)
+    monkeypatch.setattr(data_search, "ee", fake_ee)
+    geometry = {"features": [{"geometry": {"coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}}]}
+
+    images = data_search.GEECatalog().search_images(geometry, "2023-01-01", "2023-12-31")
+
+    assert list(images) == dates
+    # one getInfo per instrument
+    assert fake_ee.round_trips == len(data_search.GEECatalog.instruments)
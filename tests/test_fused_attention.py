@@ -0,0 +1,45 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("geospatial_fm")
+
+from geospatial_fm import FusedAttention, TemporalViTEncoder  # noqa: E402
+
+
+def make_encoder(fused_attention, num_frames):
+    return TemporalViTEncoder(
+        img_size=32,
+        patch_size=16,
+        num_frames=num_frames,
+        in_chans=3,
+        embed_dim=32,
+        depth=2,
+        num_heads=4,
+        fused_attention=fused_attention,
+    ).eval()
+
+
+def test_fused_attention_keeps_the_checkpoint_keys():
+    reference = make_encoder(False, 2)
+    fused = make_encoder(True, 2)
+
+    assert isinstance(fused.blocks[0].attn, FusedAttention)
+    assert list(fused.state_dict()) == list(reference.state_dict())
+    # loads strictly both ways
+    fused.load_state_dict(reference.state_dict(), strict=True)
+    reference.load_state_dict(fused.state_dict(), strict=True)
+
+
+@pytest.mark.parametrize("num_frames", [1, 3])
+def test_fused_attention_matches_the_timm_attention(num_frames):
+    torch.manual_seed(0)
+    reference = make_encoder(False, num_frames)
+    fused = make_encoder(True, num_frames)
+    fused.load_state_dict(reference.state_dict(), strict=True)
+    x = torch.randn(2, 3, num_frames, 32, 48)
+
+    with torch.no_grad():
+        expected = reference(x)[0]
+        actual = fused(x)[0]
+
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,64 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("geospatial_fm")
+
+from geospatial_fm import (  # noqa: E402
+    ConvTransformerTokensToEmbeddingNeck,
+    GeospatialNeck,
+    TemporalViTEncoder,
+)
+
+EMBED_DIM = 32
+NUM_FRAMES = 2
+
+
+def make_encoder():
+    return TemporalViTEncoder(
+        img_size=32,
+        patch_size=16,
+        num_frames=NUM_FRAMES,
+        in_chans=3,
+        embed_dim=EMBED_DIM,
+        depth=1,
+        num_heads=2,
+    ).eval()
+
+
+def make_necks():
+    return [
+        ConvTransformerTokensToEmbeddingNeck(
+            embed_dim=EMBED_DIM * NUM_FRAMES, output_embed_dim=8, Hp=2, Wp=2
+        ).eval(),
+        GeospatialNeck(
+            embed_dim=EMBED_DIM * NUM_FRAMES, first_conv_channels=16, Hp=2, Wp=2
+        ).eval(),
+    ]
+
+
+# 2x8 patches would also fit a square 4x4 grid, 14x32 fits no grid with the 2x2 aspect
+@pytest.mark.parametrize("height, width", [(32, 128), (224, 512), (48, 32)])
+def test_necks_follow_the_patch_grid_of_the_input(height, width):
+    encoder = make_encoder()
+    x = torch.randn(1, 3, NUM_FRAMES, height, width)
+
+    with torch.no_grad():
+        features = encoder(x)
+        assert tuple(features[1]) == (height // 16, width // 16)
+        for neck in make_necks():
+            (out,) = neck(features)
+            assert out.shape[-2:] == (height, width)
+
+
+def test_necks_keep_the_spatial_layout_of_the_tokens():
+    neck = make_necks()[0]
+    tokens = torch.randn(1, 1 + NUM_FRAMES * 2 * 8, EMBED_DIM)
+
+    # rolling the tokens along the width rolls the 16x upsampled output by 16 pixels
+    grid = tokens[:, 1:].reshape(1, NUM_FRAMES, 2, 8, EMBED_DIM)
+    rolled = torch.cat([tokens[:, :1], grid.roll(1, dims=3).reshape(1, -1, EMBED_DIM)], dim=1)
+
+    with torch.no_grad():
+        (out,) = neck((tokens, (2, 8)))
+        (out_rolled,) = neck((rolled, (2, 8)))
+    torch.testing.assert_close(out_rolled, out.roll(16, dims=3))
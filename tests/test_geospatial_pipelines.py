@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("geospatial_fm")
+
+from mmseg.datasets.pipelines import Compose  # noqa: E402
+
+BANDS = [0, 1, 2, 3, 4, 5]
+NUM_FRAMES = 2
+MEANS = [494.9, 815.2, 924.3, 2968.9, 2634.6, 1739.6] * NUM_FRAMES
+STDS = [284.9, 357.6, 575.6, 896.6, 951.9, 921.4] * NUM_FRAMES
+
+
+def reference_pipeline(bands):
+    return Compose([
+        dict(type="BandsExtract", bands=bands),
+        dict(type="ToTensor", keys=["img"]),
+        dict(type="TorchPermute", keys=["img"], order=(2, 0, 1)),
+        dict(type="TorchNormalize", means=MEANS, stds=STDS),
+        dict(
+            type="Reshape",
+            keys=["img"],
+            new_shape=(len(bands) // NUM_FRAMES, NUM_FRAMES, -1, -1),
+            look_up={"2": 1, "3": 2},
+        ),
+        dict(type="CastTensor", keys=["img"], new_type="torch.FloatTensor"),
+    ])
+
+
+def fused_pipeline(bands):
+    return Compose([
+        dict(
+            type="TorchFusedPreprocess",
+            bands=bands,
+            num_frames=NUM_FRAMES,
+            means=MEANS,
+            stds=STDS,
+        ),
+    ])
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.float32])
+def test_fused_preprocess_matches_the_unfused_steps(dtype):
+    bands = [b + 6 * f for f in range(NUM_FRAMES) for b in BANDS]
+    img = np.random.default_rng(0).integers(0, 4000, (40, 56, 14)).astype(dtype)
+
+    expected = reference_pipeline(bands)({"img": img.astype(np.float32)})["img"]
+    actual = fused_pipeline(bands)({"img": img})["img"]
+
+    assert actual.dtype == torch.float32
+    assert actual.shape == expected.shape == (len(BANDS), NUM_FRAMES, 40, 56)
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_fused_preprocess_takes_batches():
+    bands = list(range(12))
+    imgs = np.random.default_rng(1).random((3, 16, 16, 12), dtype=np.float32) * 4000
+
+    batch = fused_pipeline(bands)({"img": imgs})["img"]
+
+    for img, out in zip(imgs, batch):
+        torch.testing.assert_close(out, reference_pipeline(bands)({"img": img})["img"])
+
+
+def test_process_test_pipeline_overrides_the_bands_of_the_fused_step():
+    burn_scar_model_inference = pytest.importorskip("burn_scar_model_inference")
+    test_pipeline = [
+        dict(type="LoadGeospatialImageFromFile", to_float32=False),
+        dict(type="TorchFusedPreprocess", bands=BANDS, means=MEANS, stds=STDS),
+        dict(type="CollectTestList", keys=["img"], meta_keys=[]),
+    ]
+
+    processed = burn_scar_model_inference.process_test_pipeline(test_pipeline, "[5, 4, 3]")
+
+    assert processed[1]["bands"] == [5, 4, 3]
+    assert test_pipeline[1]["bands"] == BANDS
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("mmseg")
+pytest.importorskip("matplotlib")
+pytest.importorskip("psutil")
+pytest.importorskip("geospatial_fm")
+
+from mmcv import Config  # noqa: E402
+from mmseg.datasets.pipelines import Compose  # noqa: E402
+
+from model_inference import adapt_test_pipeline  # noqa: E402
+
+CONFIGS = os.path.join(os.path.dirname(__file__), os.pardir, "Prithvi", "configs")
+
+
+def load_test_pipeline(name="burn_scars_Prithvi_100M_array.py"):
+    return Config.fromfile(os.path.join(CONFIGS, name)).data.test.pipeline
+
+
+def test_adapt_test_pipeline_collects_metas_without_bands():
+    test_pipeline = load_test_pipeline()
+
+    adapted = adapt_test_pipeline(test_pipeline)
+
+    collect = [step for step in adapted if step["type"] == "CollectTestListArray"][0]
+    assert "ori_shape" in collect["meta_keys"]
+    # the config itself is left untouched
+    assert test_pipeline[-1]["meta_keys"] == []
+
+    data = Compose(adapted)({"img_info": {"array": np.random.rand(64, 64, 6)}})
+    meta = data["img_metas"].data[0]
+    assert meta["ori_shape"][:2] == (64, 64)
+
+
+def test_adapt_test_pipeline_extracts_bands():
+    test_pipeline = load_test_pipeline()
+
+    adapted = adapt_test_pipeline(test_pipeline, bands="[0, 1, 2]")
+
+    extract = [step for step in adapted if step["type"] == "BandsExtract"][0]
+    assert extract["bands"] == [0, 1, 2]
+    assert [step for step in test_pipeline if step["type"] == "BandsExtract"][0]["bands"] != [
+        0, 1, 2
+    ]
+
+
+def test_adapt_test_pipeline_extracts_bands_in_the_fused_step():
+    test_pipeline = [
+        dict(type="LoadGeospatialImageFromArray", to_float32=False, channels_last=True),
+        dict(type="TorchFusedPreprocess", bands=[0, 1, 2, 3], means=[0] * 4, stds=[1] * 4),
+        dict(type="CollectTestListArray", keys=["img"], meta_keys=[]),
+    ]
+
+    adapted = adapt_test_pipeline(test_pipeline, bands="[3, 2]")
+
+    assert adapted[1]["bands"] == [3, 2]
+    assert test_pipeline[1]["bands"] == [0, 1, 2, 3]
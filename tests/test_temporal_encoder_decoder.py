@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("geospatial_fm")
+
+from geospatial_fm import TemporalEncoderDecoder  # noqa: E402
+
+
+class FakeSegmentor:
+    """What slide_inference needs of a TemporalEncoderDecoder, with a pointwise model"""
+
+    out_channels = 2
+    align_corners = False
+
+    def __init__(self, crop_size, stride, slide_batch_size):
+        self.test_cfg = SimpleNamespace(
+            crop_size=crop_size,
+            stride=stride,
+            get=lambda key, default=None: slide_batch_size,
+        )
+
+    def window_forward(self, crop_img, img_meta):
+        # position dependent, so misplaced windows change the result
+        rows = torch.arange(crop_img.shape[-2]).reshape(-1, 1)
+        return torch.stack([crop_img.sum(dim=(1, 2)) + rows, -crop_img.mean(dim=(1, 2))], 1)
+
+
+def reference_slide_inference(segmentor, img):
+    """Sliding window with one window at a time, as in mmseg"""
+    h_stride, w_stride = segmentor.test_cfg.stride
+    h_crop, w_crop = segmentor.test_cfg.crop_size
+    batch_size, _, _, h_img, w_img = img.shape
+    h_grids = max(h_img - h_crop + h_stride - 1, 0) // h_stride + 1
+    w_grids = max(w_img - w_crop + w_stride - 1, 0) // w_stride + 1
+    preds = img.new_zeros((batch_size, segmentor.out_channels, h_img, w_img))
+    count_mat = img.new_zeros((batch_size, 1, h_img, w_img))
+    for h_idx in range(h_grids):
+        for w_idx in range(w_grids):
+            y1, x1 = h_idx * h_stride, w_idx * w_stride
+            y2, x2 = min(y1 + h_crop, h_img), min(x1 + w_crop, w_img)
+            y1, x1 = max(y2 - h_crop, 0), max(x2 - w_crop, 0)
+            crop_seg_logit = segmentor.window_forward(img[..., y1:y2, x1:x2], None)
+            preds[:, :, y1:y2, x1:x2] += crop_seg_logit
+            count_mat[:, :, y1:y2, x1:x2] += 1
+    return preds / count_mat
+
+
+@pytest.mark.parametrize("slide_batch_size", [1, 3, 100])
+@pytest.mark.parametrize("size", [(50, 70), (20, 30), (16, 64)])
+def test_slide_inference_matches_one_window_at_a_time(slide_batch_size, size):
+    segmentor = FakeSegmentor((32, 32), (16, 16), slide_batch_size)
+    img = torch.randn(2, 3, 2, *size)
+
+    preds = TemporalEncoderDecoder.slide_inference(segmentor, img, None, rescale=False)
+
+    torch.testing.assert_close(preds, reference_slide_inference(segmentor, img))
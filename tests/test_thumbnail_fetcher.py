@@ -0,0 +1,52 @@
+import io
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("requests")
+Image = pytest.importorskip("PIL.Image")
+
+from thumbnail_fetcher import ThumbnailFetcher  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+def png_bytes(value):
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((4, 4, 3), value, dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_fetcher(max_workers=8):
+    fetcher = ThumbnailFetcher(max_workers=max_workers)
+    fetcher.session.get = lambda url, timeout: FakeResponse(png_bytes(int(url.split("/")[-1])))
+    return fetcher
+
+
+def test_fetch_many_gets_the_urls_on_the_download_threads():
+    fetcher = make_fetcher()
+    # every url is only returned once all of them are being requested at the same time
+    barrier = threading.Barrier(4, timeout=10)
+
+    def get_url(value):
+        barrier.wait()
+        return f"https://thumbnails/{value}"
+
+    arrays = list(fetcher.fetch_many([10, 20, 30, 40], max_workers=4, get_url=get_url))
+
+    assert [int(array[0, 0, 0]) for array in arrays] == [10, 20, 30, 40]
+
+
+def test_fetch_many_sizes_the_connection_pool_to_the_workers():
+    fetcher = make_fetcher(max_workers=2)
+
+    list(fetcher.fetch_many(["https://thumbnails/1"], max_workers=16))
+
+    assert fetcher.session.get_adapter("https://thumbnails")._pool_maxsize == 16